@@ -76,16 +76,18 @@ class Robot(object):
             raise Exception("unknown direction {}".format(self.direction))
             
     def run(self):
+        # The program reads the color under the robot and outputs a
+        # (color, direction) pair for each move, until it halts.
+        io = self.intcode.coroutine(arity=2)
+        moves = next(io)
         while True:
-            self.intcode.add_input(self.current_color())
-            new_color = self.intcode.run(break_on_output=True)
-            if new_color is None:
-                # Intcode has halted
+            for new_color, direction in moves:
+                self.paint(new_color)
+                self.turn(direction)
+                self.move_forward()
+            if self.intcode.is_halted():
                 return
-            direction = self.intcode.run(break_on_output=True)
-            self.paint(new_color)
-            self.turn(direction)
-            self.move_forward()
+            moves = io.send(self.current_color())
 
 def part1():
     r = Robot()
@@ -1,22 +1,116 @@
 #! /usr/bin/env python3
 
 import curses
-import io
+import sys
 import time
 
 from intcode import Intcode
 
+
+class Screen(object):
+    # The game screen, kept in memory: "rows" holds one bytearray of
+    # tile ids per row, grown as the program draws further out. The
+    # score, ball and paddle positions and the number of blocks left
+    # are tracked as tiles are drawn, so nothing ever has to scan the
+    # screen. If "dirty" is a set, the (x, y) of every cell drawn is
+    # added to it, for a Renderer to pick up.
+
+    EMPTY, WALL, BLOCK, PADDLE, BALL = range(0, 5)
+
+    def __init__(self):
+        self.rows = []
+        self.width = 0
+        self.score = None
+        self.ball = None
+        self.paddle = None
+        self.blocks = 0
+        self.dirty = None
+
+    def _grow(self, x, y):
+        if x >= self.width:
+            self.width = x + 1
+            for row in self.rows:
+                row.extend(bytes(self.width - len(row)))
+        while y >= len(self.rows):
+            self.rows.append(bytearray(self.width))
+
+    def draw(self, outputs):
+        # Apply the draw instructions in outputs, a flat sequence of
+        # (x, y, tile id) triples.
+        rows = self.rows
+        dirty = self.dirty
+        values = iter(outputs)
+        for x, y, tile_id in zip(values, values, values):
+            if x == -1 and y == 0:
+                self.score = tile_id
+                continue
+            try:
+                row = rows[y]
+                old = row[x]
+            except IndexError:
+                self._grow(x, y)
+                row = rows[y]
+                old = row[x]
+            row[x] = tile_id
+            if old == Screen.BLOCK:
+                self.blocks -= 1
+            if tile_id == Screen.BLOCK:
+                self.blocks += 1
+            elif tile_id == Screen.BALL:
+                self.ball = (x, y)
+            elif tile_id == Screen.PADDLE:
+                self.paddle = (x, y)
+            if dirty is not None:
+                dirty.add((x, y))
+
+    def text(self, tiles=" |#-o"):
+        return "\n".join("".join(tiles[t] for t in row) for row in self.rows)
+
+
+class Renderer(object):
+    # Draws a Screen with curses. Only the cells drawn since the last
+    # frame are redrawn, and at most max_fps frames are drawn a second;
+    # draw calls in between are skipped, and the cells they would have
+    # drawn are picked up by the next frame.
+
+    def __init__(self, stdscr, screen, tiles, max_fps=60):
+        self.stdscr = stdscr
+        self.screen = screen
+        self.tiles = tiles
+        self.interval = 1.0 / max_fps
+        self.next_frame = 0
+        self.frames = 0
+        screen.dirty = set()
+
+    def draw(self, force=False):
+        now = time.monotonic()
+        if now < self.next_frame and not force:
+            return
+        self.next_frame = now + self.interval
+        screen = self.screen
+        rows = screen.rows
+        addch = self.stdscr.addch
+        tiles = self.tiles
+        for x, y in screen.dirty:
+            addch(y, x, tiles[rows[y][x]])
+        screen.dirty.clear()
+        self.stdscr.refresh()
+        self.frames += 1
+
+
 class Arcade(object):
     
-    def __init__(self, filename="adv13_input.txt"):
-        self.intcode = Intcode.from_file(filename)
+    def __init__(self, filename="adv13_input.txt", compiled=False):
+        self.intcode = Intcode.from_file(filename, compiled=compiled)
+        self.screen = Screen()
+        self.renderer = None
         self.score = None
         self.ball_coords = None
         self.paddle_coords = None
 
     # The curses ACS_* constants are not available until after curses.initscr()
     # has been called so this has to be delayed
-    
+
     def init_curses():
         Arcade.TILES = [
             ' ',                  # tile_id 0 = empty
@@ -25,74 +119,140 @@ class Arcade(object):
             curses.ACS_HLINE  ,   # tile_id 3 = paddle
             curses.ACS_DIAMOND,   # tile_id 4 = ball
         ]
-    
-    def run(self):
+
+    # Headless, the game runs without curses: the screen is only kept
+    # in memory, and the machine's output is taken in bulk each time
+    # it blocks for input rather than one tile at a time, so playing
+    # a game is a pure compute job. part1() and part2() also compile
+    # the program when headless.
+
+    def run(self, headless=False):
+        if headless:
+            return self._run(None)
         return curses.wrapper(self._run)
 
     def _run(self, stdscr):
-        Arcade.init_curses()
-        stdscr.clear()
-        while True:
-            status = self.intcode.run(break_on_output=3)
-            if status is None:
-                break
-            x, y, tile_id = status
-            stdscr.addch(y, x, Arcade.TILES[tile_id])
-            stdscr.refresh()
-        self.blockcount = 0
-        for y in range(0, stdscr.getmaxyx()[0]):
-            for x in range(0, stdscr.getmaxyx()[1]):
-                if stdscr.inch(y,x) == Arcade.TILES[2]:
-                    self.blockcount += 1
-
-    def play(self):
+        self._start(stdscr)
+        self.intcode.run()
+        self._update(force=True)
+        self.blockcount = self.screen.blocks
+
+    def play(self, headless=False):
+        if headless:
+            return self._play(None)
         return curses.wrapper(self._play)
 
     def _play(self, stdscr):
-        Arcade.init_curses()
-        stdscr.clear()
+        self._start(stdscr)
         # Set memory address 0 to 2 to pay for free.
         self.intcode.poke(0, 2)
         # Run the game until it terminates for some reason
         while True:
-            self._play_until_blocked(stdscr)
+            self.intcode.run()
+            self._update(force=self.intcode.is_halted())
             if self.intcode.is_halted():
                 break
-            # Move the paddle in the direction of the ball
-            joystick = 0
-            if self.paddle_coords[0] < self.ball_coords[0]:
-                joystick = 1
-            elif self.paddle_coords[0] > self.ball_coords[0]:
-                joystick = -1
+            self.intcode.add_input(self._joystick())
 
-            self.intcode.add_input(joystick)
+    def discover(self, max_frames=10000):
+        # Play the game as _play() does, headless, until the memory
+        # cells holding the ball's x, the paddle's x and the score have
+        # been pinned down: a cell is a candidate for one of them only
+        # while it has held the value drawn on screen at every frame
+        # so far. Returns the three addresses, or raises ValueError if
+        # the game ends, or max_frames pass, before they are found.
+        intcode = self.intcode
+        peek = intcode.peek
+        candidates = [None, None, None]
+        for _ in range(0, max_frames):
+            intcode.run()
+            self._update()
+            if intcode.is_halted():
+                break
+            values = (self.ball_coords[0], self.paddle_coords[0], self.score)
+            for i, value in enumerate(values):
+                addrs = candidates[i]
+                if addrs is None:
+                    addrs = set(range(0, len(intcode.program))) | intcode.dirty
+                candidates[i] = {addr for addr in addrs if peek(addr) == value}
+            if all(len(addrs) == 1 for addrs in candidates):
+                return tuple(addrs.pop() for addrs in candidates)
+            self.intcode.add_input(self._joystick())
+        raise ValueError("could not find the ball, paddle and score in memory")
 
-    def _play_until_blocked(self, stdscr):
+    def fast_play(self):
+        # Play the game to the end without decoding what it draws. The
+        # addresses of the ball, paddle and score are found once with
+        # discover(); after that, each time the program waits for the
+        # joystick, the ball and paddle are read straight out of its
+        # memory and the output is thrown away. Returns the number of
+        # frames (joystick inputs) played per second once discovery
+        # is over.
+        intcode = self.intcode
+        intcode.poke(0, 2)
+        ball, paddle, score = self.discover()
+        start = time.perf_counter()
+        self.intcode.add_input(self._joystick())
+        peek = intcode.peek
+        outputs = intcode.outputs
+        frames = 1
         while True:
-            output = self.intcode.run(break_on_output=3)
-            if output is None:
+            intcode.run()
+            outputs.clear()
+            if intcode.is_halted():
                 break
-            x, y, tile_id = output
-            if x == -1 and y == 0:
-                self.score = tile_id
-                continue
-            if tile_id == 3:
-                self.paddle_coords = (x, y)
-            elif tile_id == 4:
-                self.ball_coords = (x, y)
-            stdscr.addch(y, x, Arcade.TILES[tile_id])
-            stdscr.refresh()
+            ball_x = peek(ball)
+            paddle_x = peek(paddle)
+            intcode.add_input((ball_x > paddle_x) - (ball_x < paddle_x))
+            frames += 1
+        self.score = peek(score)
+        return frames / (time.perf_counter() - start)
+
+    def _joystick(self):
+        # Move the paddle in the direction of the ball
+        if self.paddle_coords[0] < self.ball_coords[0]:
+            return 1
+        elif self.paddle_coords[0] > self.ball_coords[0]:
+            return -1
+        return 0
+
+    def _start(self, stdscr):
+        if stdscr is not None:
+            Arcade.init_curses()
+            stdscr.clear()
+            self.renderer = Renderer(stdscr, self.screen, Arcade.TILES)
+
+    def _update(self, force=False):
+        # Draw every complete (x, y, tile id) triple the machine has
+        # output so far onto the screen.
+        outputs = self.intcode.outputs
+        values = [outputs.popleft() for _ in range(0, len(outputs) - len(outputs) % 3)]
+        screen = self.screen
+        screen.draw(values)
+        self.score = screen.score
+        self.ball_coords = screen.ball
+        self.paddle_coords = screen.paddle
+        if self.renderer is not None:
+            self.renderer.draw(force)
 
 
-def part1():
-    game = Arcade()
-    game.run()
+def part1(headless=False):
+    game = Arcade(compiled=headless)
+    game.run(headless)
     print(game.blockcount)
 
 
-def part2():
-    game = Arcade()
-    game.play()
+def part2(headless=False, fast=False):
+    if fast:
+        # Always headless: nothing is drawn
+        game = Arcade(compiled=True)
+        fps = game.fast_play()
+        print(game.intcode.state)
+        print(game.score)
+        print("{:.0f} frames/s".format(fps))
+        return
+    game = Arcade(compiled=headless)
+    game.play(headless)
     print(game.intcode.state)
     print(game.ball_coords)
     print(game.paddle_coords)
@@ -100,4 +260,4 @@ def part2():
 
 
 if __name__ == "__main__":
-    part2()
+    part2(fast="--fast" in sys.argv[1:])
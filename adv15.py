@@ -35,20 +35,23 @@ class RepairDroid(object):
     def __init__(self, intcode):
         self.intcode = intcode
         self.ship_map = {}
+        self.io = None   # The machine's coroutine, once step() starts
 
     def from_file(filename="adv15_input.txt"):
         intcode = Intcode.from_file(filename)
         return RepairDroid(intcode)
 
     def step(self, pos=(0,0), return_direction=0):
+        if self.io is None:
+            self.io = self.intcode.coroutine()
+            next(self.io)
         for d in [Direction.NORTH, Direction.SOUTH, Direction.EAST, Direction.WEST]:
             # Don't explore a square we've already explored, that's silly
             new_pos = Direction.move(pos, d)
             if new_pos in self.ship_map:
                 continue
             # Attempt to move in this direction and find out what happens
-            self.intcode.add_input(d)
-            result = self.intcode.run(break_on_output=1)
+            result, = self.io.send(d)
             if result[0] == 0:
                 # Wall
                 self.ship_map[new_pos] = "#"
@@ -63,8 +66,37 @@ class RepairDroid(object):
                 raise Exception("got unknown intcode result {}".format(result))
             self.step(new_pos, return_direction=Direction.OPPOSITE[d])
         # If we got here, we are done exploring this part of the map and should return
-        self.intcode.add_input(return_direction)
-        self.intcode.run(break_on_output=1)
+        self.io.send(return_direction)
+
+    def explore(self):
+        # Map the ship breadth-first. Rather than walking one droid
+        # back and forth, each square reached is held as its own
+        # forked copy of the droid's Intcode machine, and every
+        # unexplored neighbour is probed by a fresh fork of it. A move
+        # is therefore never undone, and each open square costs only
+        # the moves needed to probe its neighbours.
+        frontier = [((0,0), self.intcode)]
+        while frontier:
+            next_frontier = []
+            for pos, intcode in frontier:
+                for d in [Direction.NORTH, Direction.SOUTH, Direction.EAST, Direction.WEST]:
+                    new_pos = Direction.move(pos, d)
+                    if new_pos in self.ship_map:
+                        continue
+                    droid = intcode.fork()
+                    droid.add_input(d)
+                    result = droid.run(break_on_output=1)
+                    if result[0] == 0:
+                        self.ship_map[new_pos] = "#"
+                        continue
+                    if result[0] == 1:
+                        self.ship_map[new_pos] = "."
+                    elif result[0] == 2:
+                        self.ship_map[new_pos] = "O"
+                    else:
+                        raise Exception("got unknown intcode result {}".format(result))
+                    next_frontier.append((new_pos, droid))
+            frontier = next_frontier
 
     def bfs(self, start, target="O"):
         # Perform a breadth-first search of the map, beginning at start,
@@ -118,19 +150,26 @@ class RepairDroid(object):
         return output
 
     
-def part1():
+def map_ship(explore=False):
+    # Map the ship either by walking a single droid around it (step)
+    # or breadth-first from forked droids (explore).
     droid = RepairDroid.from_file()
     droid.ship_map[(0,0)] = "X"
-    droid.step()
+    if explore:
+        droid.explore()
+    else:
+        droid.step()
+    return droid
+
+def part1(explore=False):
+    droid = map_ship(explore)
 
     # Perform a breadth-first search of the map to find the shortest
     # path to the oxygen system.
     print(droid.bfs(start=(0,0)))
 
-def part2():
-    droid = RepairDroid.from_file()
-    droid.ship_map[(0,0)] = "X"
-    droid.step()
+def part2(explore=False):
+    droid = map_ship(explore)
 
     # Perform a breadth-first search of the map, starting from the
     # oxygen system, to find out how long it will take the map to
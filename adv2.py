@@ -1,70 +1,276 @@
 #! /usr/bin/env python3
 
-class Intcode(object):
+import os
 
-    OP_ADD = 1
-    OP_MUL = 2
-    OP_HALT = 99
+from concurrent.futures import ProcessPoolExecutor
+
+import intcode_batch
+
+from intcode import Intcode, ListMemory, load_program
+from intcode_batch import BatchIntcode
+
+
+class Intractable(Exception):
+    pass
+
+
+class Poly(object):
+
+    # A polynomial in the noun and verb, stored as a dict mapping
+    # (i, j) to the coefficient of the term noun**i * verb**j.
+
+    def __init__(self, terms):
+        self.terms = {k: c for k, c in terms.items() if c}
+
+    def constant(c):
+        return Poly({(0, 0): c})
+
+    def __add__(self, other):
+        terms = dict(self.terms)
+        for k, c in other.terms.items():
+            terms[k] = terms.get(k, 0) + c
+        return Poly(terms)
+
+    def __mul__(self, other):
+        terms = {}
+        for (i1, j1), c1 in self.terms.items():
+            for (i2, j2), c2 in other.terms.items():
+                k = (i1 + i2, j1 + j2)
+                terms[k] = terms.get(k, 0) + c1 * c2
+        return Poly(terms)
+
+    def __repr__(self):
+        return "<Poly {}>".format(self.terms)
+
+    def value(self):
+        # Return the value of a constant polynomial, or None if the
+        # polynomial depends on the noun or verb.
+        if any(k != (0, 0) for k in self.terms):
+            return None
+        return self.terms.get((0, 0), 0)
+
+    def evaluate(self, noun, verb):
+        return sum(c * noun**i * verb**j for (i, j), c in self.terms.items())
+
+
+class SymbolicIntcode(object):
+
+    # Runs an ADD/MUL program once, with the noun and verb (addresses
+    # 1 and 2) left as unknowns, tracking the contents of every memory
+    # cell as a Poly in the noun and verb.
+    #
+    # A cell read through an address that depends on the noun or verb
+    # cannot be known, and is recorded as None; that is fine as long
+    # as the program overwrites it before relying on it (the gravity
+    # assist program does exactly this with its first instruction).
+    # Anything that would make control flow or the set of cells
+    # written depend on the noun or verb -- an unknown opcode, a write
+    # through an unknown address -- raises Intractable.
 
     def __init__(self, data):
         self.pc = 0
-        self.memory = data.copy()
+        self.memory = [Poly.constant(x) for x in data]
+        self.memory[1] = Poly({(1, 0): 1})
+        self.memory[2] = Poly({(0, 1): 1})
 
-    def poke(self, addr, num):
-        self.memory[addr] = num
-    
-    def peek(self, addr):
-        return self.memory[addr]
-    
-    def step(self):
-        opcode = self.memory[self.pc]
-        if opcode == Intcode.OP_ADD:
-            addr1, addr2, addr3 = self.memory[self.pc+1:self.pc+4]
-            self.memory[addr3] = self.memory[addr1] + self.memory[addr2]
-            self.pc += 4
-        elif opcode == Intcode.OP_MUL:
-            addr1, addr2, addr3 = self.memory[self.pc+1:self.pc+4]
-            self.memory[addr3] = self.memory[addr1] * self.memory[addr2]
-            self.pc += 4
-        elif opcode == Intcode.OP_HALT:
-            return False
-        return True
+    def address(self, addr):
+        # Return the concrete address stored at addr, or None.
+        cell = self.memory[addr]
+        if cell is None or cell.value() is None:
+            return None
+        if not 0 <= cell.value() < len(self.memory):
+            raise Intractable("address {} out of range".format(cell.value()))
+        return cell.value()
 
     def run(self):
-        while self.step():
-            pass
+        while True:
+            if not 0 <= self.pc < len(self.memory):
+                raise Intractable("pc {} out of range".format(self.pc))
+            cell = self.memory[self.pc]
+            opcode = None if cell is None else cell.value()
+            if opcode is None:
+                raise Intractable("unknown opcode at {}".format(self.pc))
+            if opcode == Intcode.OP_HALT:
+                return self.memory[0]
+            if opcode not in (Intcode.OP_ADD, Intcode.OP_MUL) or \
+               self.pc + 3 >= len(self.memory):
+                raise Intractable("opcode {} at {}".format(opcode, self.pc))
+            addr1, addr2, addr3 = [self.address(a)
+                                   for a in range(self.pc+1, self.pc+4)]
+            if addr3 is None:
+                raise Intractable("unknown write address at {}".format(self.pc))
+            if addr1 is None or addr2 is None:
+                result = None
+            else:
+                x, y = self.memory[addr1], self.memory[addr2]
+                if x is None or y is None:
+                    result = None
+                elif opcode == Intcode.OP_ADD:
+                    result = x + y
+                else:
+                    result = x * y
+            self.memory[addr3] = result
+            self.pc += 4
 
 
-def part1(program):
-    code = Intcode(program)
-    code.poke(1, 12)
-    code.poke(2, 2)
+def solve_symbolic(program, target):
+    # Find the noun and verb that make the program produce target, by
+    # running it once symbolically and solving the resulting
+    # polynomial. Returns (noun, verb), or None if there is no
+    # solution. Raises Intractable if the program cannot be run
+    # symbolically.
+    result = SymbolicIntcode(program).run()
+    if result is None:
+        raise Intractable("result depends on an unknown cell")
+
+    for noun in range(0, 100):
+        # Substitute the noun, leaving a polynomial in the verb. If it
+        # is linear (as it is for the puzzle input) solve for the verb
+        # directly, otherwise try every verb.
+        by_power = {}
+        for (i, j), c in result.terms.items():
+            by_power[j] = by_power.get(j, 0) + c * noun**i
+        if all(j <= 1 for j in by_power):
+            a, b = by_power.get(1, 0), by_power.get(0, 0)
+            if a == 0:
+                verbs = range(0, 100) if b == target else []
+            elif (target - b) % a == 0:
+                verbs = [(target - b) // a]
+            else:
+                verbs = []
+        else:
+            verbs = range(0, 100)
+        for verb in verbs:
+            if 0 <= verb < 100 and result.evaluate(noun, verb) == target:
+                return noun, verb
+    return None
+
+
+def load(program):
+    # Return a machine loaded with program, for running it with many
+    # nouns and verbs: reset() it between trials rather than building
+    # a new one each time.
+    return Intcode(program, memory=ListMemory)
+
+
+def run_trial(code, noun, verb):
+    # Run the program in code with the given noun and verb from its
+    # pristine state, and return the value left at address 0.
+    code.reset()
+    code.poke(1, noun)
+    code.poke(2, verb)
     code.run()
-    print(code.peek(0))
+    return code.peek(0)
+
+
+# Per-process state for the parallel brute-force search: the program
+# is sent to each worker once, when it starts, and loaded into a
+# machine that is reset for every trial.
+_worker_code = None
+
+
+def _init_worker(program):
+    global _worker_code
+    _worker_code = load(program)
+
+
+def _try_noun(noun, target):
+    # Return the first verb that gives target with this noun, or None.
+    # A noun and verb that make the program run into memory that isn't
+    # an instruction simply aren't a solution.
+    for verb in range(0, 100):
+        try:
+            result = run_trial(_worker_code, noun, verb)
+        except (IndexError, KeyError):
+            continue
+        if result == target:
+            return verb
+    return None
+
+
+def solve_brute_force(program, target, workers=None):
+    # Try every noun and verb, spreading the nouns over a pool of
+    # worker processes. Returns (noun, verb) for the first noun that
+    # has a solution, or None.
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(program,)) as pool:
+        nouns = range(0, 100)
+        for noun, verb in zip(nouns, pool.map(_try_noun, nouns,
+                                               [target] * len(nouns))):
+            if verb is not None:
+                return noun, verb
+    return None
+
+
+def solve_batch(program, target):
+    # Try every noun and verb at once, as 10000 lanes of a
+    # BatchIntcode. Returns (noun, verb) for the first noun and verb
+    # (in the same order as solve_brute_force) that give target, or None.
+    # Needs numpy.
+    pairs = [(noun, verb) for noun in range(0, 100) for verb in range(0, 100)]
+    # The program only touches its own words, so a tight memory keeps
+    # the 10000 x width matrix small; a lane that goes past it falls
+    # back to the scalar interpreter.
+    batch = BatchIntcode(program, len(pairs), memory_size=len(program) + 8)
+    batch.poke(1, [noun for noun, _ in pairs])
+    batch.poke(2, [verb for _, verb in pairs])
+    batch.run()
+    for lane, result in enumerate(batch.peek(0)):
+        if lane not in batch.errors and result == target:
+            return pairs[lane]
+    return None
+
+
+def solve(program, target=19690720):
+    # Find the noun and verb that produce target: symbolically if the
+    # program allows it, otherwise by brute force, in one batch if
+    # numpy is available or across worker processes if not. Returns
+    # (noun, verb, method), where method is "symbolic", "batch" or
+    # "brute-force"; noun and verb are None if there is no solution.
+    try:
+        solution = solve_symbolic(program, target)
+        method = "symbolic"
+    except Intractable:
+        if intcode_batch.np is not None:
+            solution = solve_batch(program, target)
+            method = "batch"
+        else:
+            solution = solve_brute_force(program, target)
+            method = "brute-force"
+    if solution is None:
+        return None, None, method
+    return solution[0], solution[1], method
+
+
+def part1(program):
+    print(run_trial(load(program), 12, 2))
 
 
-def part2(program, target=19690720):
+def part2(program, target=19690720, symbolic=False):
+    if symbolic:
+        noun, verb, method = solve(program, target)
+        if noun is None:
+            print("No solution found ({})".format(method))
+        else:
+            print("FOUND: noun={} verb={} result={} ({})".format(
+                noun, verb, noun*100 + verb, method))
+        return
+    code = load(program)
     for i in range(0, 99):
         for j in range(0, 99):
-            code = Intcode(program)
-            code.poke(1, i)
-            code.poke(2, j)
-            code.run()
-            print("noun={} verb={} output={}".format(i, j, code.peek(0)))
-            if code.peek(0) == target:
+            output = run_trial(code, i, j)
+            print("noun={} verb={} output={}".format(i, j, output))
+            if output == target:
                 print("FOUND: noun={} verb={} result={}".format(i, j, i*100 + j))
                 return
-            if code.peek(0) > target:
+            if output > target:
                 break
     print("No solution found")
     
 
 def read_input(filename):
-    data = []
-    with open(filename, "r") as f:
-        for line in f:
-            data.extend([int(x) for x in line.split(",")])
-    return data
+    return list(load_program(filename))
 
 if __name__ == "__main__":
     data = read_input("adv2_input.txt")
@@ -1,19 +1,15 @@
 #! /usr/bin/env python3
 
-from intcode import Intcode
+from intcode import Intcode, load_program
 
 
 def part1(data):
     intcode = Intcode(data)
     intcode.run()
-    print(intcode.outputs)
+    print(list(intcode.outputs))
     
 def read_input(filename):
-    data = []
-    with open(filename, "r") as f:
-        for line in f:
-            data.extend([int(x) for x in line.split(",")])
-    return data
+    return list(load_program(filename))
 
 
 if __name__ == "__main__":
@@ -1,84 +1,167 @@
 #! /usr/bin/env python3
 
 import itertools
-
-from intcode import Intcode
-
-
-def run_amps_with_phase_settings(program, phase_settings):
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+from intcode import Intcode, Network, load_program
+
+
+def run_amp(program, phase, input_val, cache=None, intcode=None):
+    # Run a single amp and return its output signal. An amp's output
+    # depends only on its phase setting and its input signal, so if a
+    # cache dict is given, results are memoized in it under
+    # (phase, input_val).
+    #
+    # If intcode is given it must be a machine loaded with program; it
+    # is reset and reused rather than building a new one.
+    if cache is not None and (phase, input_val) in cache:
+        return cache[(phase, input_val)]
+    if intcode is None:
+        intcode = Intcode(program, [phase, input_val])
+    else:
+        intcode.reset([phase, input_val])
+    intcode.run()
+    result = intcode.outputs[0]
+    if cache is not None:
+        cache[(phase, input_val)] = result
+    return result
+
+
+def run_amps_with_phase_settings(program, phase_settings, cache=None):
     input_val = 0
-
+    intcode = Intcode(program)
     for i in phase_settings:
-        machine_inputs = [i, input_val]
-        intcode = Intcode(program, machine_inputs)
-        result = intcode.run()
-        input_val = intcode.outputs[0]
-    return intcode.outputs[0]
-
-
-def run_all(program):
-    # Generate a list of inputs sorted from largest to smallest
-    best_result = 0
-    for p in itertools.permutations("01234", 5):
-        phase_settings = [int(n) for n in p]
-        result = run_amps_with_phase_settings(program, phase_settings)
-        if result > best_result:
+        input_val = run_amp(program, i, input_val, cache, intcode)
+    return input_val
+
+
+def search_phase_tree(program, phases):
+    # Find the best ordering of phases for a chain of amps without
+    # feedback, returning (best_result, best_phase_settings, runs),
+    # where runs is the number of amps actually executed.
+    #
+    # Orderings are walked as a tree: all the orderings that start
+    # with the same phases share the signal computed for that prefix,
+    # so each prefix is only run once. Amp results are also memoized
+    # by (phase, input signal), which catches identical stages that
+    # are reached through different prefixes.
+    #
+    # The tree is walked in the same order as itertools.permutations,
+    # and ties go to the first ordering, as in search_phase_settings.
+    cache = {}
+    best = [None, None]
+    intcode = Intcode(program)
+
+    def walk(prefix, remaining, signal):
+        if not remaining:
+            if best[0] is None or signal > best[0]:
+                best[0] = signal
+                best[1] = prefix
+            return
+        for i, phase in enumerate(remaining):
+            output = run_amp(program, phase, signal, cache, intcode)
+            walk(prefix + [phase], remaining[:i] + remaining[i+1:], output)
+
+    walk([], list(phases), 0)
+    return best[0], best[1], len(cache)
+
+
+# Per-process state for parallel searches. Each worker process
+# receives the program once, when it starts, rather than once per
+# permutation it evaluates.
+_worker_program = None
+_worker_run_amps = None
+
+
+def _init_worker(program, run_amps):
+    global _worker_program, _worker_run_amps
+    _worker_program = program
+    _worker_run_amps = run_amps
+
+
+def _run_worker(phase_settings):
+    return _worker_run_amps(_worker_program, phase_settings)
+
+
+def search_phase_settings(program, phases, run_amps,
+                          parallel=False, workers=None):
+    # Run the amps with every ordering of the given phases, using
+    # run_amps (run_amps_with_phase_settings or
+    # run_amps_with_feedback_loop), and return the best result
+    # together with the phase settings that produced it.
+    #
+    # With parallel=True the permutations are farmed out to a pool of
+    # worker processes (os.cpu_count() of them unless workers is
+    # given). Results come back in permutation order either way, and
+    # ties go to the first permutation, so the answer is the same
+    # however the work is split.
+    permutations = list(itertools.permutations(phases))
+    if parallel:
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(program, run_amps)) as pool:
+            chunksize = max(1, len(permutations) // (workers * 4))
+            results = pool.map(_run_worker, permutations, chunksize=chunksize)
+            results = list(results)
+    else:
+        results = [run_amps(program, p) for p in permutations]
+
+    best_result = None
+    best_phase_settings = None
+    for phase_settings, result in zip(permutations, results):
+        if best_result is None or result > best_result:
             best_result = result
+            best_phase_settings = list(phase_settings)
+    return best_result, best_phase_settings
+
 
+def run_all(program, parallel=False, workers=None):
+    if parallel:
+        best_result, _ = search_phase_settings(
+            program, range(0, 5), run_amps_with_phase_settings,
+            parallel, workers)
+    else:
+        best_result, _, _ = search_phase_tree(program, range(0, 5))
     return best_result
 
 
 def run_amps_with_feedback_loop(program, phase_settings):
-    # Set up the array of amps each with its phase setting
-    amps = []
-    for i in phase_settings:
-        amps.append(Intcode(program, [i]))
+    # Wire the amps into a ring, each with its phase setting: every
+    # amp feeds the next one, and the last amp feeds back into the first.
+    network = Network()
+    for i, phase in enumerate(phase_settings):
+        network.add_machine(i, Intcode(program, [phase]))
+    for i in range(0, len(phase_settings)):
+        network.connect(i, (i + 1) % len(phase_settings))
 
     # The first amp starts with input 0
-    amps[0].add_input(0)
-
-    i = 0
-    final_output = 0
-    while True:
-        output = amps[i].run(break_on_output=True)
-        if i == 4:
-            if output is None:
-                # The last amp program halted, so we're done
-                break
-            # Not yet done, save the output in case we need it
-            final_output = output
-        i = (i + 1) % 5
-        amps[i].add_input(output)
-
-    return final_output
-        
-
-def run_with_feedback_loop(program):
-    # Generate a list of inputs sorted from largest to smallest
-    best_result = 0
-    for p in itertools.permutations("56789", 5):
-        phase_settings = [int(n) for n in p]
-        result = run_amps_with_feedback_loop(program, phase_settings)
-        if result > best_result:
-            best_result = result
+    network.send(0, 0)
+    network.run()
+
+    # The answer is the last signal the last amp sent
+    return network.last_outputs[len(phase_settings) - 1]
+
 
+def run_with_feedback_loop(program, parallel=False, workers=None):
+    best_result, _ = search_phase_settings(
+        program, range(5, 10), run_amps_with_feedback_loop,
+        parallel, workers)
     return best_result
 
 
 def read_intcode(filename):
-    program = []
-    with open(filename, "r") as f:
-        for line in f:
-            program.extend([int(x) for x in line.split(",")])
-    return program
+    return list(load_program(filename))
 
 
-def part1(filename="adv7_input.txt"):
+def part1(filename="adv7_input.txt", parallel=False):
     program = read_intcode(filename)
-    result = run_all(program)
+    result = run_all(program, parallel)
     print(result)
 
-def part2(filename="adv7_input.txt"):
+def part2(filename="adv7_input.txt", parallel=False):
     program = read_intcode(filename)
-    result = run_with_feedback_loop(program)
+    result = run_with_feedback_loop(program, parallel)
     print(result)
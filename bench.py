@@ -0,0 +1,252 @@
+#! /usr/bin/env python3
+
+# Benchmark runner for the Advent of Code day modules.
+#
+# Every advN.py module in this directory is imported, and each of its
+# part1()/part2() functions is timed: one warm-up run, then a number of
+# timed runs (the best and mean wall times are reported). Peak memory
+# is measured in one extra run under tracemalloc, which is kept apart
+# from the timed runs because tracing slows Python down considerably.
+# Anything the parts print is captured and kept (with the value
+# returned, if any) as the part's result, so that a change which makes
+# a day faster but wrong shows up too.
+#
+# Results are written as JSON, by default to bench_results.json, tagged
+# with the current git commit. Pass --compare with an earlier results
+# file to print the speed ratio of each part against it.
+#
+# Usage:
+#   ./bench.py                         benchmark every day
+#   ./bench.py 7 9 13                  benchmark only days 7, 9 and 13
+#   ./bench.py --repeat 5 --compare old.json
+
+import argparse
+import contextlib
+import glob
+import importlib
+import inspect
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+# Parts that need arguments, or that must be run differently from a
+# plain call to partN(). Each entry maps a day number to a dict of
+# part name to a function that takes the imported module and runs
+# that part. Parts not listed here are called with no arguments.
+
+def _adv3(module, part):
+    panel = module.WirePanel()
+    for label, wire in enumerate(module.read_input("adv3_input.txt")):
+        panel.add_wire(wire, label)
+    return part(panel)
+
+
+def _adv5(module, system_id):
+    # adv5.part1() runs the diagnostic program with no input, so it
+    # stops at the first INPUT; feed it the system ID instead.
+    intcode = module.Intcode(module.read_input("adv5_input.txt"), [system_id])
+    intcode.run()
+    return list(intcode.outputs)
+
+
+def _adv6(module):
+    return module.OrbitMap(module.read_input("adv6_input.txt"))
+
+
+PARTS = {
+    1: {
+        "part1": lambda m: m.part1(m.read_input("adv1_input.txt")),
+        "part2": lambda m: m.part2(m.read_input("adv1_input.txt")),
+    },
+    2: {
+        "part1": lambda m: m.part1(m.read_input("adv2_input.txt")),
+        "part2": lambda m: m.part2(m.read_input("adv2_input.txt")),
+    },
+    3: {
+        "part1": lambda m: _adv3(m, m.part1),
+        "part2": lambda m: _adv3(m, m.part2),
+    },
+    5: {
+        "part1": lambda m: _adv5(m, 1),
+        "part2": lambda m: _adv5(m, 5),
+    },
+    6: {
+        "part1": lambda m: m.part1(_adv6(m)),
+        "part2": lambda m: m.part2(_adv6(m), "YOU", "SAN"),
+    },
+    # adv13 draws the game with curses; run it headless instead.
+    13: {
+        "part1": lambda m: m.part1(headless=True),
+        "part2": lambda m: m.part2(headless=True),
+    },
+}
+
+
+def day_modules(days=None):
+    # Return (day, module name) for every advN.py module, in day order.
+    found = []
+    for filename in glob.glob(os.path.join(os.path.dirname(__file__) or ".", "adv*.py")):
+        m = re.match(r"adv(\d+)\.py$", os.path.basename(filename))
+        if m:
+            day = int(m.group(1))
+            if days is None or day in days:
+                found.append((day, "adv{}".format(day)))
+    return sorted(found)
+
+
+def day_parts(day, module):
+    # Return (part name, thunk) for each part of the day to benchmark.
+    parts = []
+    overrides = PARTS.get(day, {})
+    for name in ("part1", "part2"):
+        if name in overrides:
+            parts.append((name, lambda f=overrides[name]: f(module)))
+            continue
+        part = getattr(module, name, None)
+        if part is None:
+            continue
+        params = inspect.signature(part).parameters.values()
+        if any(p.default is inspect.Parameter.empty for p in params):
+            # Needs arguments nobody told us how to supply
+            continue
+        parts.append((name, part))
+    return parts
+
+
+def run_captured(thunk, max_length=1000):
+    # Run thunk with stdout captured. Returns (result, error), where
+    # result is the value returned, or failing that what was printed
+    # (only the last max_length characters, where answers usually are).
+    out = io.StringIO()
+    error = None
+    value = None
+    try:
+        with contextlib.redirect_stdout(out):
+            value = thunk()
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    if value is not None:
+        result = str(value)
+    else:
+        result = out.getvalue().strip()
+    return result[-max_length:], error
+
+
+def bench_part(thunk, repeat=3, warmup=1, memory=True):
+    stats = {}
+    for _ in range(0, warmup):
+        result, error = run_captured(thunk)
+        if error:
+            return {"error": error}
+
+    times = []
+    for _ in range(0, repeat):
+        start = time.perf_counter()
+        result, error = run_captured(thunk)
+        times.append(time.perf_counter() - start)
+        if error:
+            return {"error": error}
+    stats["best"] = min(times)
+    stats["mean"] = sum(times) / len(times)
+    stats["runs"] = len(times)
+    stats["result"] = result
+
+    if memory:
+        tracemalloc.start()
+        try:
+            run_captured(thunk)
+            stats["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return stats
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(__file__) or ".").decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(days=None, repeat=3, warmup=1, memory=True):
+    # The day modules open their input files by relative path.
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "warmup": warmup,
+        "parts": {},
+    }
+    for day, module_name in day_modules(days):
+        try:
+            module = importlib.import_module(module_name)
+        except Exception as e:
+            results["parts"][module_name] = {
+                "error": "{}: {}".format(type(e).__name__, e)}
+            continue
+        for name, thunk in day_parts(day, module):
+            key = "{}.{}".format(module_name, name)
+            print("{:<12}".format(key), end="", flush=True)
+            stats = bench_part(thunk, repeat, warmup, memory)
+            results["parts"][key] = stats
+            if "error" in stats:
+                print("ERROR {}".format(stats["error"]))
+            else:
+                print("{:>10.4f}s  {:>10}  {}".format(
+                    stats["best"],
+                    "{:.1f}KiB".format(stats["peak_memory"] / 1024)
+                    if "peak_memory" in stats else "",
+                    stats["result"].replace("\n", " | ")[-40:]))
+    return results
+
+
+def compare(results, baseline):
+    # Print the speed of each part relative to an earlier run.
+    print("\n{:<12}{:>10}{:>10}{:>8}".format("part", "before", "after", "ratio"))
+    for key, stats in sorted(results["parts"].items()):
+        old = baseline["parts"].get(key)
+        if not old or "best" not in old or "best" not in stats:
+            continue
+        flag = "" if old.get("result") == stats["result"] else "  RESULT CHANGED"
+        print("{:<12}{:>10.4f}{:>10.4f}{:>7.2f}x{}".format(
+            key, old["best"], stats["best"], old["best"] / stats["best"], flag))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the advN day modules.")
+    parser.add_argument("days", nargs="*", type=int,
+                        help="days to benchmark (default: all)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per part (default: 3)")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="untimed warm-up runs per part (default: 1)")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the tracemalloc peak memory run")
+    parser.add_argument("--output", default="bench_results.json",
+                        help="results file (default: bench_results.json)")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.days or None, args.repeat, args.warmup,
+                             not args.no_memory)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
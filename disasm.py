@@ -0,0 +1,373 @@
+#! /usr/bin/env python3
+
+# Static analysis of Intcode programs: a disassembler and control-flow
+# graph builder.
+#
+# The program is explored from address 0 by following control flow,
+# so only words that can actually be reached as instructions are
+# disassembled; everything else is data. Jumps with an immediate
+# target are followed. Jumps whose target is read from memory (the
+# puzzle programs return from subroutines by jumping through a return
+# address saved on the relative-base stack, or through a table of
+# addresses) can't be followed, so two kinds of constant that point
+# into the program are tried as extra entry points: values that ADD or
+# MUL store from two immediate operands, and the initial contents of
+# cells that a position-mode jump takes its target from. Any such
+# address that decodes as valid code up to a jump or HALT is taken as
+# code. Flow that reaches a word that isn't a valid instruction (an
+# instruction patched at run time, say), or leaves the program, stops
+# there, and the address is recorded as unresolved.
+#
+# The analysis records, for every write whose address is known
+# statically (position mode), whether it lands in code: those are the
+# self-modifying writes. Writes in relative mode can't be resolved and
+# are listed separately.
+#
+# Usage:
+#   ./disasm.py adv13_input.txt             full listing
+#   ./disasm.py adv13_input.txt --summary   regions, blocks and writes
+#   ./disasm.py adv13_input.txt --cfg       basic blocks and their edges
+
+import argparse
+import sys
+
+from intcode import Instruction, Intcode, ParameterMode, load_program
+
+
+WRITE_PARAM = {
+    Intcode.OP_ADD: 2,
+    Intcode.OP_MUL: 2,
+    Intcode.OP_LT: 2,
+    Intcode.OP_EQ: 2,
+    Intcode.OP_INPUT: 0,
+}
+
+
+def decode(program, addr):
+    # Return (Instruction, params, length) for the instruction at addr,
+    # or None if the word there is not a valid instruction.
+    try:
+        inst = Instruction(program[addr])
+    except KeyError:
+        return None
+    if any(mode > ParameterMode.RELATIVE for mode in inst.param_mode):
+        return None
+    length = 1 if inst.opcode == Intcode.OP_HALT else 1 + inst.param_count
+    if addr + length > len(program):
+        return None
+    return inst, list(program[addr + 1:addr + length]), length
+
+
+def successors(addr, decoded):
+    # Return (successor addresses, indirect) for the instruction
+    # decoded at addr, where indirect is set if it is a jump whose
+    # target is only known at run time.
+    inst, params, length = decoded
+    op = inst.opcode
+    if op == Intcode.OP_HALT:
+        return [], False
+    if op not in (Intcode.OP_JMPIF, Intcode.OP_JMPIFNOT):
+        return [addr + length], False
+    cond_mode, target_mode = inst.param_mode
+    indirect = target_mode != ParameterMode.IMMEDIATE
+    targets = []
+    if cond_mode == ParameterMode.IMMEDIATE:
+        # A jump on a constant: either always or never taken
+        taken = bool(params[0]) == (op == Intcode.OP_JMPIF)
+        if not taken:
+            return [addr + length], False
+    else:
+        targets.append(addr + length)
+    if not indirect:
+        targets.append(params[1])
+    return targets, indirect
+
+
+def format_param(mode, value):
+    if mode == ParameterMode.IMMEDIATE:
+        return "#{}".format(value)
+    if mode == ParameterMode.RELATIVE:
+        return "[rb{:+d}]".format(value)
+    return "[{}]".format(value)
+
+
+def format_instruction(inst, params):
+    if inst.opcode == Intcode.OP_HALT:
+        return inst.name
+    return "{:<9}{}".format(inst.name, ", ".join(
+        format_param(mode, value) for mode, value in zip(inst.param_mode, params)))
+
+
+class Block(object):
+
+    # A basic block: the instructions from start up to (not including)
+    # end. "successors" are the addresses control can pass to next,
+    # and "indirect" is set if the block ends in a jump whose target
+    # is only known at run time.
+
+    def __init__(self, start):
+        self.start = start
+        self.end = start
+        self.addrs = []
+        self.successors = []
+        self.indirect = False
+
+    def __repr__(self):
+        return "<Block {}-{} -> {}{}>".format(
+            self.start, self.end, self.successors,
+            " +indirect" if self.indirect else "")
+
+
+class Analysis(object):
+
+    def __init__(self, program):
+        self.program = tuple(program)
+        # Address to (Instruction, params, length), for every word
+        # reached as an instruction
+        self.instructions = {}
+        # Entry points guessed from stored constants that decoded as code
+        self.guessed_entries = set()
+        self.indirect_jumps = []     # Addresses of jumps with run-time targets
+        self.self_modifying = []     # (instruction address, code address written)
+        self.unknown_writes = []     # Addresses of writes in relative mode
+        self.unresolved = set()      # Invalid words reached by control flow
+        self.static_writes = {}      # Address written to instruction addresses writing it
+        self.blocks = {}             # Block start to Block
+
+        self._explore([0], self.instructions)
+        self._guess_entries()
+        self.code = self._covered()
+        self._find_writes()
+        self._build_blocks()
+
+    def successors(self, addr):
+        return successors(addr, self.instructions[addr])
+
+    def _explore(self, entries, found):
+        # Follow control flow from entries, adding every instruction
+        # reached to found. Returns False (leaving found partially
+        # updated) as soon as an invalid instruction or an address
+        # outside the program is reached, except when exploring from
+        # the program's real entry point (found is self.instructions),
+        # where such addresses are just recorded and the walk goes on.
+        pending = list(entries)
+        while pending:
+            addr = pending.pop()
+            if addr in found or addr in self.instructions:
+                continue
+            decoded = None
+            if 0 <= addr < len(self.program):
+                decoded = decode(self.program, addr)
+            if decoded is None:
+                if found is self.instructions:
+                    self.unresolved.add(addr)
+                    continue
+                return False
+            found[addr] = decoded
+            targets, _ = successors(addr, decoded)
+            pending.extend(targets)
+        return True
+
+    def _guess_entries(self):
+        # Try every constant stored by ADD/MUL from two immediate
+        # operands, and the initial value of every cell read as a jump
+        # target, as an entry point, as long as the program has any
+        # indirect jumps for it to be the target of. Repeat, since
+        # newly found code can give more such constants.
+        tried = set()
+        while True:
+            if not any(self.successors(a)[1] for a in self.instructions):
+                return
+            candidates = set()
+            for addr, (inst, params, _) in self.instructions.items():
+                if inst.opcode in (Intcode.OP_ADD, Intcode.OP_MUL) and \
+                   inst.param_mode[0] == inst.param_mode[1] == ParameterMode.IMMEDIATE:
+                    if inst.opcode == Intcode.OP_ADD:
+                        value = params[0] + params[1]
+                    else:
+                        value = params[0] * params[1]
+                    if 0 < value < len(self.program):
+                        candidates.add(value)
+                elif inst.opcode in (Intcode.OP_JMPIF, Intcode.OP_JMPIFNOT) and \
+                     inst.param_mode[1] == ParameterMode.POSITION and \
+                     0 <= params[1] < len(self.program):
+                    value = self.program[params[1]]
+                    if 0 < value < len(self.program):
+                        candidates.add(value)
+            candidates -= tried
+            candidates -= set(self.instructions)
+            if not candidates:
+                return
+            covered = self._covered()
+            for entry in sorted(candidates):
+                tried.add(entry)
+                found = {}
+                if not self._explore([entry], found):
+                    continue
+                # Code that overlaps known instructions without lining
+                # up with them is a misreading.
+                if any(a in covered for start, (_, _, length) in found.items()
+                       for a in range(start, start + length)):
+                    continue
+                self.instructions.update(found)
+                self.guessed_entries.add(entry)
+                covered = self._covered()
+
+    def _covered(self):
+        # Return the set of addresses inside known instructions.
+        covered = set()
+        for addr, (_, _, length) in self.instructions.items():
+            covered.update(range(addr, addr + length))
+        return covered
+
+    def _find_writes(self):
+        for addr in sorted(self.instructions):
+            inst, params, _ = self.instructions[addr]
+            if inst.opcode in (Intcode.OP_JMPIF, Intcode.OP_JMPIFNOT) and \
+               inst.param_mode[1] != ParameterMode.IMMEDIATE:
+                self.indirect_jumps.append(addr)
+            if inst.opcode not in WRITE_PARAM:
+                continue
+            i = WRITE_PARAM[inst.opcode]
+            if inst.param_mode[i] == ParameterMode.RELATIVE:
+                self.unknown_writes.append(addr)
+                continue
+            target = params[i]
+            self.static_writes.setdefault(target, []).append(addr)
+            if target in self.code:
+                self.self_modifying.append((addr, target))
+
+    def _build_blocks(self):
+        leaders = {0} | self.guessed_entries
+        for addr in self.instructions:
+            targets, indirect = self.successors(addr)
+            inst = self.instructions[addr][0]
+            if inst.opcode in (Intcode.OP_JMPIF, Intcode.OP_JMPIFNOT,
+                               Intcode.OP_HALT):
+                leaders.update(targets)
+                leaders.add(addr + self.instructions[addr][2])
+        # A self-modified instruction starts a block of its own, so
+        # that the code around it can still be treated as fixed.
+        for _, target in self.self_modifying:
+            for addr in self.instructions:
+                if addr <= target < addr + self.instructions[addr][2]:
+                    leaders.add(addr)
+        leaders &= set(self.instructions)
+
+        for start in sorted(leaders):
+            block = Block(start)
+            addr = start
+            while True:
+                block.addrs.append(addr)
+                length = self.instructions[addr][2]
+                targets, indirect = self.successors(addr)
+                nxt = addr + length
+                block.end = nxt
+                if targets != [nxt] or indirect or nxt in leaders or \
+                   nxt not in self.instructions:
+                    block.successors = [t for t in targets if t in self.instructions]
+                    block.indirect = indirect
+                    break
+                addr = nxt
+            self.blocks[start] = block
+
+    def regions(self):
+        # Return the program split into maximal runs of code and data,
+        # as a list of (start, end, "code" or "data").
+        regions = []
+        for addr in range(0, len(self.program)):
+            kind = "code" if addr in self.code else "data"
+            if regions and regions[-1][2] == kind and regions[-1][1] == addr:
+                regions[-1] = (regions[-1][0], addr + 1, kind)
+            else:
+                regions.append((addr, addr + 1, kind))
+        return regions
+
+    def listing(self):
+        # Return the disassembly as a list of lines.
+        lines = []
+        modified = {target for _, target in self.self_modifying}
+        addr = 0
+        while addr < len(self.program):
+            if addr in self.instructions:
+                inst, params, length = self.instructions[addr]
+                notes = []
+                if addr in self.blocks:
+                    notes.append("block")
+                if addr in self.guessed_entries:
+                    notes.append("entry?")
+                if any(a in modified for a in range(addr, addr + length)):
+                    notes.append("self-modified")
+                lines.append("{:>6}  {:<40}{}".format(
+                    addr, format_instruction(inst, params),
+                    "; " + ", ".join(notes) if notes else ""))
+                addr += length
+                continue
+            end = addr
+            while end < len(self.program) and end not in self.instructions \
+                  and end - addr < 8:
+                end += 1
+            lines.append("{:>6}  DATA     {}".format(
+                addr, ", ".join(str(w) for w in self.program[addr:end])))
+            addr = end
+        return lines
+
+    def summary(self):
+        regions = self.regions()
+        lines = [
+            "{} words: {} code, {} data".format(
+                len(self.program), len(self.code),
+                len(self.program) - len(self.code)),
+            "{} instructions in {} basic blocks, {} guessed entry points".format(
+                len(self.instructions), len(self.blocks), len(self.guessed_entries)),
+            "{} indirect jumps, {} relative-mode writes".format(
+                len(self.indirect_jumps), len(self.unknown_writes)),
+            "{} self-modifying writes".format(len(self.self_modifying)),
+        ]
+        if self.unresolved:
+            lines.append("control reaches invalid words at {}".format(
+                ", ".join(str(a) for a in sorted(self.unresolved))))
+        for addr, target in self.self_modifying:
+            lines.append("  {} writes code at {}".format(addr, target))
+        lines.append("regions:")
+        for start, end, kind in regions:
+            lines.append("  {:>6}-{:<6} {}".format(start, end - 1, kind))
+        return lines
+
+    def cfg(self):
+        lines = []
+        for start in sorted(self.blocks):
+            block = self.blocks[start]
+            lines.append("{:>6}-{:<6} -> {}{}".format(
+                block.start, block.end - 1,
+                ", ".join(str(s) for s in block.successors) or "-",
+                " (+indirect)" if block.indirect else ""))
+        return lines
+
+
+def analyze(filename):
+    return Analysis(load_program(filename))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Disassemble an Intcode program.")
+    parser.add_argument("filename")
+    parser.add_argument("--summary", action="store_true",
+                        help="print code/data regions and self-modifying writes")
+    parser.add_argument("--cfg", action="store_true",
+                        help="print the basic blocks and their successors")
+    args = parser.parse_args(argv)
+
+    analysis = analyze(args.filename)
+    if args.summary:
+        lines = analysis.summary()
+    elif args.cfg:
+        lines = analysis.cfg()
+    else:
+        lines = analysis.listing()
+    for line in lines:
+        print(line)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+#! /usr/bin/env python3
+
+# Generators for synthetic puzzle inputs of any size.
+#
+# The puzzle inputs are all small, so they say nothing about how the
+# solvers scale. Each generator here produces a valid input for one
+# day, in the same text format as its advN_input.txt, from a size and
+# a random seed (the same size and seed always give the same input):
+#
+#   wires      adv3   two wires of "size" segments each
+#   orbits     adv6   an orbit map of "size" bodies, biased towards deep
+#                     chains, with YOU and SAN orbiting two of them
+#   asteroids  adv10  a size x size asteroid field
+#   reactions  adv14  "size" reactions forming a deep dependency graph
+#   fft        adv16  a signal of "size" digits
+#
+# Each generator has a matching solver which runs the day's existing
+# code on a generated input, and sweep() times the solver over a range
+# of sizes so that scaling curves can be plotted.
+#
+# Usage:
+#   ./generate_inputs.py wires 1000 --seed 7 > wires.txt
+#   ./generate_inputs.py sweep orbits 100 1000 10000
+
+import argparse
+import random
+import string
+import sys
+import time
+
+import adv3
+import adv6
+import adv10
+import adv14
+import adv16
+
+
+MOVES = {"R": (1, 0), "L": (-1, 0), "U": (0, 1), "D": (0, -1)}
+
+
+def wire_corners(segments):
+    # Return the points a wire turns at, starting with the origin.
+    x, y = 0, 0
+    corners = [(x, y)]
+    for segment in segments:
+        dx, dy = MOVES[segment[0]]
+        length = int(segment[1:])
+        x, y = x + dx * length, y + dy * length
+        corners.append((x, y))
+    return corners
+
+
+def generate_wires(size, seed=0):
+    # The second wire makes size - 2 random moves and then heads for a
+    # random point on the first wire, one horizontal and one vertical
+    # segment away, so that the wires are sure to cross.
+    rng = random.Random(seed)
+    first = ["{}{}".format(rng.choice("RLUD"), rng.randint(1, 100))
+             for _ in range(0, size)]
+    if size < 2:
+        # A single segment can only cross by running along the other
+        second = ["{}{}".format(first[0][0], rng.randint(1, 100))]
+        return "\n".join([",".join(first), ",".join(second)]) + "\n"
+
+    second = ["{}{}".format(rng.choice("RLUD"), rng.randint(1, 100))
+              for _ in range(0, size - 2)]
+    end_x, end_y = wire_corners(second)[-1]
+    corners = wire_corners(first)
+    for _ in range(0, 100):
+        i = rng.randrange(0, size)
+        (x0, y0), (x1, y1) = corners[i], corners[i + 1]
+        t = rng.randint(1, abs(x1 - x0) + abs(y1 - y0))
+        x = x0 + t * (x1 > x0) - t * (x1 < x0)
+        y = y0 + t * (y1 > y0) - t * (y1 < y0)
+        if x != end_x and y != end_y and (x, y) != (0, 0):
+            second.append("{}{}".format("R" if x > end_x else "L", abs(x - end_x)))
+            second.append("{}{}".format("U" if y > end_y else "D", abs(y - end_y)))
+            break
+    else:
+        # Every point tried lines up with the end of the random moves
+        # (the first wire is nearly straight): two copies of a wire
+        # cross everywhere.
+        second = first
+    return "\n".join([",".join(first), ",".join(second)]) + "\n"
+
+
+def body_names(count, rng):
+    # Return count distinct three-character body names, none of which
+    # is COM, YOU or SAN.
+    alphabet = string.ascii_uppercase + string.digits
+    names = set()
+    while len(names) < count:
+        name = "".join(rng.choice(alphabet) for _ in range(0, 3))
+        if name not in ("COM", "YOU", "SAN"):
+            names.add(name)
+    return sorted(names)
+
+
+def generate_orbits(size, seed=0, depth_bias=0.99):
+    # Each new body orbits the most recently added body with
+    # probability depth_bias, and a random earlier body otherwise, so
+    # a depth_bias near 1 makes long chains.
+    rng = random.Random(seed)
+    bodies = ["COM"]
+    lines = []
+    for name in body_names(size, rng):
+        if rng.random() < depth_bias:
+            center = bodies[-1]
+        else:
+            center = rng.choice(bodies)
+        lines.append("{}){}".format(center, name))
+        bodies.append(name)
+    lines.append("{})YOU".format(rng.choice(bodies[1:])))
+    lines.append("{})SAN".format(rng.choice(bodies[1:])))
+    rng.shuffle(lines)
+    return "\n".join(lines) + "\n"
+
+
+def generate_asteroids(size, seed=0, density=0.3):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(0, size):
+        rows.append("".join("#" if rng.random() < density else "."
+                            for _ in range(0, size)))
+    # Make sure there is at least one asteroid to put a station on
+    rows[0] = "#" + rows[0][1:]
+    return "\n".join(rows) + "\n"
+
+
+def generate_reactions(size, seed=0, max_ingredients=3):
+    # Chemicals are numbered 0 (FUEL) to size-1; each one is made from
+    # up to max_ingredients chemicals with higher numbers, or from ORE,
+    # so the graph is acyclic and every chemical is reachable from ORE.
+    # Chemical i always uses chemical i+1, which makes the graph at
+    # least size reactions deep.
+    rng = random.Random(seed)
+    names = ["FUEL"] + body_names(size - 1, rng)
+    lines = []
+    for i, chemical in enumerate(names):
+        ingredients = set()
+        if i + 1 < len(names):
+            ingredients.add(names[i + 1])
+            later = names[i + 1:]
+            for _ in range(0, rng.randint(0, max_ingredients - 1)):
+                ingredients.add(rng.choice(later))
+        if not ingredients or rng.random() < 0.2:
+            ingredients.add("ORE")
+        requirement = ", ".join("{} {}".format(rng.randint(1, 10), c)
+                                for c in sorted(ingredients))
+        lines.append("{} => {} {}".format(requirement, rng.randint(1, 10), chemical))
+    rng.shuffle(lines)
+    return "\n".join(lines) + "\n"
+
+
+def generate_fft(size, seed=0):
+    rng = random.Random(seed)
+    return "".join(rng.choice(string.digits) for _ in range(0, size)) + "\n"
+
+
+def solve_wires(text):
+    panel = adv3.WirePanel()
+    for label, wire in enumerate(text.split()):
+        panel.add_wire(wire, label)
+    return adv3.part1(panel)
+
+
+def solve_orbits(text):
+    return adv6.OrbitMap(text.split()).sum_orbits()
+
+
+def solve_asteroids(text):
+    return adv10.AsteroidMap(text.strip()).find_best_station()
+
+
+def solve_reactions(text):
+    return adv14.calculate_requirements(adv14.ReactionChart(text))
+
+
+def solve_fft(text, phases=1):
+    return adv16.FFT(text.strip()).fft(max_phase=phases)[0:8]
+
+
+GENERATORS = {
+    "wires":     (generate_wires,     solve_wires),
+    "orbits":    (generate_orbits,    solve_orbits),
+    "asteroids": (generate_asteroids, solve_asteroids),
+    "reactions": (generate_reactions, solve_reactions),
+    "fft":       (generate_fft,       solve_fft),
+}
+
+
+def generate(kind, size, seed=0):
+    return GENERATORS[kind][0](size, seed)
+
+
+def sweep(kind, sizes, seed=0):
+    # Time the solver for kind on a generated input of each size.
+    # Returns a list of (size, input bytes, seconds, result or error).
+    generator, solver = GENERATORS[kind]
+    results = []
+    for size in sizes:
+        text = generator(size, seed)
+        start = time.perf_counter()
+        try:
+            result = solver(text)
+        except Exception as e:
+            result = "{}: {}".format(type(e).__name__, e)
+        elapsed = time.perf_counter() - start
+        results.append((size, len(text), elapsed, result))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate large synthetic puzzle inputs.")
+    parser.add_argument("kind", choices=sorted(GENERATORS) + ["sweep"],
+                        help="input to generate, or sweep to time a solver")
+    parser.add_argument("args", nargs="+",
+                        help="size to generate, or for sweep: kind and sizes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.kind != "sweep":
+        sys.stdout.write(generate(args.kind, int(args.args[0]), args.seed))
+        return
+
+    kind = args.args[0]
+    if kind not in GENERATORS:
+        parser.error("unknown kind {}".format(kind))
+    print("{:>10} {:>12} {:>10}  result".format("size", "bytes", "seconds"))
+    for size in [int(s) for s in args.args[1:]]:
+        for size, length, elapsed, result in sweep(kind, [size], args.seed):
+            print("{:>10} {:>12} {:>10.4f}  {}".format(size, length, elapsed, result))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
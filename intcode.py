@@ -2,7 +2,16 @@
 
 # Implementation of the Intcode computer in Advent of Code 2019
 
-from collections import defaultdict
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+from array import array
+from collections import Counter, defaultdict, deque
 
 Opcode = {
      1: {"name": "ADD",      "param_count": 3},
@@ -26,6 +35,7 @@ class ParameterMode(object):
 
 class Instruction(object):
     def __init__(self, opcode):
+        self.word = opcode
         self.opcode = opcode % 100
         self.name = Opcode[self.opcode]["name"]
         self.param_count = Opcode[self.opcode]["param_count"]
@@ -50,6 +60,517 @@ class Instruction(object):
             self.name, self.param_count, self.param_mode)
 
 
+class DictMemory(defaultdict):
+    # Sparse memory: a dict from address to value. Any address that
+    # has never been written reads as 0. This is the default backend
+    # and copes with programs that scatter writes across a huge
+    # address space.
+
+    def __init__(self, data=()):
+        super().__init__(int)
+        for i in range(0, len(data)):
+            self[i] = data[i]
+
+    def copy(self):
+        memory = DictMemory()
+        memory.update(self)
+        return memory
+
+
+class ListMemory(list):
+    # Dense memory: a contiguous list indexed by address. Writes past
+    # the end grow the list (filling the gap with zeroes) and reads
+    # past the end return 0. Much smaller and faster than DictMemory
+    # for programs that stay within a compact address range.
+    #
+    # Plain list indexing is used on the hot path, so an out-of-range
+    # read raises IndexError; the Intcode machine catches that and
+    # falls back to get(). Intcode addresses are never negative, so
+    # Python's negative indexing is not guarded against.
+
+    def get(self, addr):
+        if addr < len(self):
+            return self[addr]
+        return 0
+
+    def grow(self, addr):
+        # Extend the list so that addr is a valid index. Grow by at
+        # least doubling so that a program walking upward through
+        # memory does not pay for a resize on every write.
+        if addr < 0:
+            raise IndexError("negative address {}".format(addr))
+        size = max(addr + 1, 2 * len(self))
+        self.extend([0] * (size - len(self)))
+
+
+class Int64Memory(array):
+    # Dense memory of 64-bit integers: like ListMemory, but held in a
+    # typed array, at 8 bytes a word, rather than as a list of int
+    # objects. Storing a value that does not fit raises OverflowError;
+    # the Intcode machine catches that and moves its memory into a
+    # ListMemory (see Intcode.promote_memory), so a program that needs
+    # big numbers still gets exactly the right answer, only without
+    # the compact representation.
+
+    def __new__(cls, data=()):
+        return super().__new__(cls, "q", data)
+
+    def get(self, addr):
+        if addr < len(self):
+            return self[addr]
+        return 0
+
+    def grow(self, addr):
+        # As ListMemory.grow.
+        if addr < 0:
+            raise IndexError("negative address {}".format(addr))
+        size = max(addr + 1, 2 * len(self))
+        self.frombytes(bytes(self.itemsize * (size - len(self))))
+
+
+class CowMemory(dict):
+    # Copy-on-write memory, used by Intcode.fork(). A CowMemory is an
+    # overlay on top of a base memory that nobody writes to any more,
+    # so any number of machines can share the same base. Writes go to
+    # the overlay only. A read of an address that is not in the
+    # overlay is looked up in the base (and its base, and so on) and
+    # the value is then cached in the overlay, so the cells a machine
+    # actually uses are soon found with a plain dict lookup.
+    #
+    # Forking a fork stacks another overlay on top, so to keep misses
+    # cheap, a chain deeper than MAX_DEPTH is flattened into a single
+    # base by fork().
+
+    MAX_DEPTH = 16
+
+    def __init__(self, base):
+        super().__init__()
+        self.base = base
+        self.depth = base.depth + 1 if isinstance(base, CowMemory) else 1
+
+    def __missing__(self, addr):
+        memory = self.base
+        while True:
+            value = dict.get(memory, addr)
+            if value is not None:
+                break
+            if not isinstance(memory, CowMemory):
+                value = 0
+                break
+            memory = memory.base
+        self[addr] = value
+        return value
+
+    def flatten(self):
+        # Return a DictMemory holding the same contents as this memory.
+        chain = [self]
+        while isinstance(chain[-1], CowMemory):
+            chain.append(chain[-1].base)
+        flat = DictMemory()
+        for memory in reversed(chain):
+            flat.update(memory)
+        return flat
+
+
+class Profile(object):
+    # Execution statistics for one Intcode machine, collected while
+    # profiling is enabled (see Intcode.enable_profiling).
+    #
+    #   opcode_counts   instructions executed, by opcode name
+    #   pc_counts       instructions executed, by address
+    #   instructions    total instructions executed inside run()
+    #   run_time        seconds spent inside run()
+    #   blocked_time    seconds spent blocked waiting for input, i.e.
+    #                   from run() returning BLOCKED until the next
+    #                   run() that finds input waiting
+
+    def __init__(self):
+        self.opcode_counts = Counter()
+        self.pc_counts = Counter()
+        self.instructions = 0
+        self.run_time = 0.0
+        self.blocked_time = 0.0
+        self.blocked_since = None
+
+    def record(self, pc, opcode):
+        self.pc_counts[pc] += 1
+        self.opcode_counts[Opcode[opcode]["name"]] += 1
+
+    def record_block(self, fn, count):
+        # A compiled block ran its first "count" instructions.
+        for i in range(0, count):
+            self.pc_counts[fn.addrs[i]] += 1
+            self.opcode_counts[Opcode[fn.opcodes[i]]["name"]] += 1
+
+    def instructions_per_second(self):
+        if not self.run_time:
+            return 0.0
+        return self.instructions / self.run_time
+
+    def as_dict(self, hot_pcs=20):
+        # Summarize the profile, listing the hot_pcs most frequently
+        # executed addresses.
+        return {
+            "instructions": self.instructions,
+            "run_time": self.run_time,
+            "instructions_per_second": self.instructions_per_second(),
+            "blocked_time": self.blocked_time,
+            "opcode_counts": dict(self.opcode_counts.most_common()),
+            "hot_pcs": self.pc_counts.most_common(hot_pcs),
+        }
+
+    def to_json(self, hot_pcs=20):
+        return json.dumps(self.as_dict(hot_pcs), indent=2)
+
+
+class FusionReport(object):
+    # What superinstruction fusion did for one Intcode machine, while
+    # it is enabled (see Intcode.enable_fusion).
+    #
+    #   fired         superinstructions executed, by pattern name
+    #                 (e.g. "LT+JMPIF")
+    #   instructions  instructions executed as part of superinstructions
+    #   dispatches    superinstruction dispatches; every instruction
+    #                 beyond the first in each saves the dispatch it
+    #                 would have cost in step()
+    #   sites         addresses at which a superinstruction was built
+    #   early_exits   superinstructions left part way through because
+    #                 they wrote to their own code
+
+    def __init__(self):
+        self.fired = Counter()
+        self.instructions = 0
+        self.dispatches = 0
+        self.sites = 0
+        self.early_exits = 0
+
+    def record(self, fn, count):
+        self.fired[fn.name] += 1
+        self.instructions += count
+        self.dispatches += 1
+        if count < len(fn.opcodes):
+            self.early_exits += 1
+
+    def dispatches_saved(self):
+        return self.instructions - self.dispatches
+
+    def as_dict(self):
+        return {
+            "fired": dict(self.fired.most_common()),
+            "instructions": self.instructions,
+            "dispatches": self.dispatches,
+            "dispatches_saved": self.dispatches_saved(),
+            "sites": self.sites,
+            "early_exits": self.early_exits,
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+
+# Binary program images.
+#
+# Parsing the comma-separated text format means an int() call per
+# word. A binary image holds the same program as a header followed by
+# one little-endian int64 per word, so loading it is a single bulk
+# conversion:
+#
+#   header    PROGRAM_MAGIC, word count (uint64), bignum count (uint64)
+#   words     word count int64s
+#   bignums   for each word that does not fit in an int64: its index
+#             (uint64), its length in bytes (uint32) and its value as a
+#             little-endian signed integer of that length
+#
+# A word that does not fit is stored as BIGNUM in the words array, and
+# its real value is found in the bignums table. Everything after the
+# magic is a "word list", which checkpoints (see Intcode.checkpoint)
+# use for their sections too.
+
+PROGRAM_MAGIC = b"INTCODE\x00"
+WORDS_HEADER = struct.Struct("<QQ")
+BIGNUM_HEADER = struct.Struct("<QI")
+BIGNUM = -2**63
+
+
+def parse_text(raw):
+    # Parse a program in the comma-separated text format, given as
+    # bytes. Line breaks separate words just as commas do.
+    raw = raw.strip()
+    if not raw:
+        return ()
+    return tuple(map(int, raw.replace(b"\n", b",").split(b",")))
+
+
+def pack_words(words):
+    # Return words (a sequence of ints) as a word list, in bytes.
+    packed = array("q")
+    bignums = []
+    for index, word in enumerate(words):
+        if BIGNUM < word < 2**63:
+            packed.append(word)
+        else:
+            packed.append(BIGNUM)
+            length = (word.bit_length() + 8) // 8
+            bignums.append(BIGNUM_HEADER.pack(index, length) +
+                           word.to_bytes(length, "little", signed=True))
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return (WORDS_HEADER.pack(len(packed), len(bignums)) +
+            packed.tobytes() + b"".join(bignums))
+
+
+def unpack_words(buffer, offset=0):
+    # Read the word list at offset in buffer (bytes, or an mmap).
+    # Returns the words as a list, and the offset just past them.
+    count, bignum_count = WORDS_HEADER.unpack_from(buffer, offset)
+    start = offset + WORDS_HEADER.size
+    end = start + 8 * count
+    packed = array("q")
+    packed.frombytes(buffer[start:end])
+    if sys.byteorder == "big":
+        packed.byteswap()
+    words = packed.tolist()
+    offset = end
+    for _ in range(0, bignum_count):
+        index, length = BIGNUM_HEADER.unpack_from(buffer, offset)
+        offset += BIGNUM_HEADER.size
+        words[index] = int.from_bytes(buffer[offset:offset + length],
+                                      "little", signed=True)
+        offset += length
+    return words, offset
+
+
+def parse_binary(buffer):
+    # Parse a binary program image from buffer (bytes, or an mmap).
+    if buffer[0:len(PROGRAM_MAGIC)] != PROGRAM_MAGIC:
+        raise ValueError("not an Intcode program image")
+    return tuple(unpack_words(buffer, len(PROGRAM_MAGIC))[0])
+
+
+def to_binary(program):
+    # Return the binary program image of program, as bytes.
+    return PROGRAM_MAGIC + pack_words(program)
+
+
+def write_binary(filename, program):
+    with open(filename, "wb") as f:
+        f.write(to_binary(program))
+
+
+def read_binary(filename):
+    # Read a binary program image by mapping the file into memory.
+    with open(filename, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return parse_binary(buffer)
+
+
+# Programs already loaded by load_program(). "by_path" maps a file's
+# absolute path to ((mtime, size), program); "by_hash" maps the hash of
+# a file's contents to the parsed program, so that a file which has
+# been touched or copied, but not changed, is not parsed again.
+# Programs are kept as tuples so that they can be shared safely.
+program_cache = {"by_path": {}, "by_hash": {}}
+
+
+def load_program(filename):
+    # Return the program in filename, in either the text or the binary
+    # format, as a tuple of ints. Repeated loads of an unchanged file
+    # come from program_cache without reading it again.
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = program_cache["by_path"].get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).hexdigest()
+    program = program_cache["by_hash"].get(digest)
+    if program is None:
+        if raw.startswith(PROGRAM_MAGIC):
+            program = parse_binary(raw)
+        else:
+            program = parse_text(raw)
+        program_cache["by_hash"][digest] = program
+    program_cache["by_path"][path] = (version, program)
+    return program
+
+
+# Checkpoints: a machine's state saved to disk (see Intcode.checkpoint).
+# Memory is stored as a delta against the program image, so the size
+# of a checkpoint depends on how much memory the program has changed,
+# not on how big it is:
+#
+#   header    CHECKPOINT_MAGIC, SHA-1 of the program image, instruction
+#             count (uint64), pc (int64), relative base (int64), state
+#             (uint8, an index into Intcode.STATES)
+#   addrs     word list of the addresses that differ from the program
+#   values    word list of the values at those addresses
+#   inputs    word list of the inputs still queued
+#   outputs   word list of the outputs not yet taken
+
+CHECKPOINT_MAGIC = b"INTCKPT\x00"
+CHECKPOINT_HEADER = struct.Struct("<8s20sQqqB")
+
+
+class Trace(object):
+    # A flight recorder for one Intcode machine, kept while tracing is
+    # enabled (see Intcode.enable_tracing). Everything is held in
+    # fixed-size ring buffers, so a trace can be left on for a run of
+    # any length:
+    #
+    #   instructions  the last "size" dispatches, as (instruction
+    #                 count, pc); in the interpreter that is every
+    #                 instruction, in compiled mode every block entered
+    #   events        the last "events" I/O events, as (instruction
+    #                 count, Trace.INPUT or Trace.OUTPUT, value); in
+    #                 compiled mode the count is that at the start of
+    #                 the block
+    #   checkpoints   the last "checkpoints" snapshots of the machine,
+    #                 one taken every "interval" instructions
+    #
+    # A checkpoint plus the inputs consumed since it are enough to
+    # rebuild the machine's state at any later instruction count, which
+    # is what replay() does.
+
+    INPUT = "in"
+    OUTPUT = "out"
+
+    def __init__(self, size=10000, events=10000, interval=100000, checkpoints=10):
+        self.instructions = deque(maxlen=size)
+        self.events = deque(maxlen=events)
+        self.checkpoints = deque(maxlen=checkpoints)
+        self.interval = interval
+        self.next_checkpoint = 0
+        self.dropped = -1       # Instruction count of the last event dropped
+
+    def record_event(self, count, kind, value):
+        events = self.events
+        if len(events) == events.maxlen:
+            self.dropped = events[0][0]
+        events.append((count, kind, value))
+
+    def restart(self, machine):
+        # Forget everything recorded so far and start again from the
+        # machine's current state, for when that state did not come
+        # from running on (e.g. after a reset).
+        self.instructions.clear()
+        self.events.clear()
+        self.checkpoints.clear()
+        self.dropped = -1
+        self.checkpoint(machine)
+
+    def checkpoint(self, machine):
+        self.checkpoints.append(machine.snapshot())
+        self.next_checkpoint = machine.instruction_count + self.interval
+
+    def replay(self, count, pending=()):
+        # Return a new machine in the state the traced machine was in
+        # after "count" instructions, rebuilt from the latest checkpoint
+        # at or before then, fed the inputs recorded since, and stepped
+        # forward. Inputs the traced machine consumed after "count",
+        # followed by pending, are left queued, so running the new
+        # machine retraces the rest of the run.
+        checkpoint = None
+        for snapshot in self.checkpoints:
+            if snapshot.instruction_count <= count:
+                checkpoint = snapshot
+        if checkpoint is None:
+            raise ValueError("no checkpoint at or before instruction {}".format(count))
+        start = checkpoint.instruction_count
+        if self.dropped >= start:
+            raise ValueError("I/O events since instruction {} are no longer "
+                             "in the trace".format(start))
+        machine = checkpoint.fork()
+        machine.inputs = deque(value for now, kind, value in self.events
+                               if kind == Trace.INPUT and now >= start)
+        machine.inputs.extend(pending)
+        # A checkpoint may have been taken while the machine was
+        # blocked; step() resumes it once there is input.
+        while machine.instruction_count < count and not machine.is_halted():
+            if machine.is_blocked() and not machine.inputs:
+                break
+            machine.step()
+        return machine
+
+
+class TracedInputs(deque):
+    # An input queue that records each value machine takes from it in
+    # the machine's Trace.
+
+    def __init__(self, values, machine):
+        super().__init__(values)
+        self.machine = machine
+
+    def popleft(self):
+        value = super().popleft()
+        machine = self.machine
+        machine.trace.record_event(machine.instruction_count, Trace.INPUT, value)
+        return value
+
+
+class Watchpoints(object):
+    # Breakpoints and watchpoints set on one Intcode machine (see
+    # Intcode.add_breakpoint and friends). Each maps what it watches to
+    # a handler, or to None:
+    #
+    #   breakpoints  pc -> handler, hit before the instruction there runs
+    #   opcodes      opcode -> handler, hit before any such instruction
+    #   reads        address -> handler, hit after an instruction reads it
+    #   writes       address -> handler, hit after an instruction writes it
+    #
+    # Watched address ranges are expanded to one entry per address, so
+    # that checking an access is a single lookup.
+    #
+    # When one is hit, its handler is called with the machine and the
+    # event, (kind, pc, address or opcode, value); the value is that
+    # read or written, or None. If there is no handler, or it returns
+    # true, the machine stops: run() returns None and the event is left
+    # in machine.watch_event. The machine is still RUNNING, and the
+    # next run() carries on from where it stopped.
+
+    BREAK = "break"
+    OPCODE = "opcode"
+    READ = "read"
+    WRITE = "write"
+
+    # Which parameters of each instruction are written; all the other
+    # parameters (except HALT's) are read.
+    WRITE_PARAMS = {1: 2, 2: 2, 3: 0, 7: 2, 8: 2}
+
+    def __init__(self):
+        self.breakpoints = {}
+        self.opcodes = {}
+        self.reads = {}
+        self.writes = {}
+        self.resume_pc = None   # pc stopped at before, not to stop at again
+
+    def __bool__(self):
+        return bool(self.breakpoints or self.opcodes or self.reads or self.writes)
+
+    def accesses(self, machine, inst):
+        # Return the addresses that inst, about to run at machine.pc,
+        # reads and the address it writes (or None).
+        reads = []
+        write = None
+        if inst.opcode == Intcode.OP_HALT:
+            return reads, write
+        write_param = Watchpoints.WRITE_PARAMS.get(inst.opcode)
+        pc = machine.pc
+        for i, mode in enumerate(inst.param_mode):
+            word = machine.peek(pc + 1 + i)
+            if mode == ParameterMode.RELATIVE:
+                addr = machine.relative_base + word
+            else:
+                addr = word
+            if i == write_param:
+                write = addr
+            elif mode != ParameterMode.IMMEDIATE:
+                reads.append(addr)
+        return reads, write
+
+
 class Intcode(object):
 
     OP_ADD      =  1
@@ -67,26 +588,391 @@ class Intcode(object):
     RUNNING     = "RUNNING"   # Machine is running or able to start
     BLOCKED     = "BLOCKED"   # Machine is blocked and waiting on input
     HALTED      = "HALTED"    # Machine has halted
+    STATES = (RUNNING, BLOCKED, HALTED)
+
+    # Functions generated by _compile_block, indexed by their source
+    # code. A block's source depends only on the code words it was
+    # compiled from, so machines running the same program (or forks of
+    # one machine that have since diverged) never compile the same
+    # block twice.
+    compiled_functions = {}
+    MAX_COMPILED_FUNCTIONS = 10000
+
+    # Instruction sequences that are executed as a single
+    # superinstruction when fusion is enabled (see enable_fusion).
+    # These are the pairs and triples that occur most often in the
+    # puzzle programs: a compare feeding a conditional jump, arithmetic
+    # chains, and relative base adjustments followed by the accesses
+    # that use them.
+    FUSIONS = {
+        (OP_LT, OP_JMPIF), (OP_LT, OP_JMPIFNOT),
+        (OP_EQ, OP_JMPIF), (OP_EQ, OP_JMPIFNOT),
+        (OP_ADD, OP_LT, OP_JMPIF), (OP_ADD, OP_LT, OP_JMPIFNOT),
+        (OP_ADD, OP_EQ, OP_JMPIF), (OP_ADD, OP_EQ, OP_JMPIFNOT),
+        (OP_ADD, OP_JMPIF), (OP_ADD, OP_JMPIFNOT),
+        (OP_MUL, OP_JMPIF), (OP_MUL, OP_JMPIFNOT),
+        (OP_ADD, OP_ADD), (OP_ADD, OP_MUL), (OP_MUL, OP_ADD), (OP_MUL, OP_MUL),
+        (OP_ADD, OP_EQ), (OP_ADD, OP_LT), (OP_MUL, OP_ADD, OP_ADD),
+        (OP_ADD, OP_REL), (OP_REL, OP_ADD), (OP_REL, OP_MUL),
+        (OP_REL, OP_LT), (OP_REL, OP_EQ),
+        (OP_REL, OP_JMPIF), (OP_REL, OP_JMPIFNOT), (OP_REL, OP_OUTPUT),
+    }
+    MAX_FUSION = 3
 
-    def __init__(self, data, inputs=[]):
+    # Superinstruction functions generated by _fuse, indexed by the
+    # opcode words they were built from and the memory backend.
+    fused_functions = {}
+
+    def __init__(self, data, inputs=[], memory=DictMemory, compiled=False):
+        # "memory" selects the memory backend: DictMemory (sparse, the
+        # default), ListMemory (dense) or Int64Memory (dense and
+        # compact, promoted to ListMemory if a value outgrows 64 bits).
+        # If "compiled" is true, run() translates the program into
+        # Python functions one basic block at a time and executes
+        # those instead of interpreting instruction by instruction.
         self.pc = 0
-        self.memory = defaultdict(int)
-        self.inputs = inputs.copy()
-        self.outputs = []
+        try:
+            self.memory = memory(data)
+        except OverflowError:
+            # The program itself holds a word too big for Int64Memory
+            self.memory = ListMemory(data)
+        # The pristine program image, and the set of addresses written
+        # since the machine was created or last reset(), so that
+        # reset() only has to rewrite those.
+        self.program = tuple(data)
+        self.program_digest = None   # SHA-1 of it, for checkpoints
+        self.dirty = set()
+        self.inputs = deque(inputs)
+        self.outputs = deque()
+        # If on_output is set, OUTPUT instructions call it with each
+        # value instead of queueing the value on self.outputs. This
+        # keeps memory bounded for programs that emit millions of
+        # values; such outputs are not seen by run(break_on_output=...).
+        self.on_output = None
         self.relative_base = 0
         self.state = Intcode.RUNNING
+        self.instruction_count = 0   # Instructions executed so far
+        self.profile = None          # Profile, if profiling is enabled
+        self.fusion = None           # FusionReport, if fusion is enabled
+        self.trace = None            # Trace, if tracing is enabled
+        self.watches = None          # Watchpoints, if any are set
+        self.watch_event = None      # The last one that stopped run()
 
-        for i in range(0, len(data)):
-            self.memory[i] = data[i]
+        # Cache of decoded instructions, indexed by address. Each entry
+        # remembers the opcode word it was decoded from, so an entry is
+        # only reused while memory at that address still holds the same
+        # word; poke() also drops the entry for any address it writes.
+        # Because entries are checked before use, forked machines can
+        # safely share one cache.
+        self.decoded = {}
+
+        # Compiled basic blocks (see _compile_block). "blocks" maps a
+        # start address to its compiled function and "block_ends" to
+        # the address just past its last instruction. "block_addrs"
+        # maps every address covered by a compiled block to the set of
+        # block start addresses covering it, so that a write to code
+        # can find the blocks it invalidates. "modified_code" records
+        # addresses of compiled code that the program has overwritten;
+        # those instructions are interpreted from then on.
+        # "blocks_shared" is set while these are shared with a forked
+        # machine; see _own_blocks().
+        self.compiled = compiled
+        self.blocks = {}
+        self.block_ends = {}
+        self.block_addrs = {}
+        self.modified_code = set()
+        self.blocks_shared = False
 
-    def from_file(filename, inputs=[]):
+        # Superinstructions built by _fuse, indexed by address: each
+        # entry is (guards, fn), where guards lists the (address, word)
+        # of every instruction fn was built from, or None if nothing
+        # is fused at that address. An entry is only used while memory
+        # still holds those words, so, like "decoded", this can be
+        # shared between forked machines.
+        self.fused = {}
+
+    def from_file(filename, inputs=[], memory=DictMemory, compiled=False):
         # Class method to generate a new Intcode computer from
-        # a program in "filename"
-        data = []
-        with open(filename, "r") as f:
-            for line in f:
-                data.extend([int(x) for x in line.split(",")])
-        return Intcode(data, inputs)
+        # a program in "filename" (see load_program)
+        return Intcode(load_program(filename), inputs, memory, compiled)
+
+    def fork(self):
+        # Return a new machine in exactly the same state as this one,
+        # which can then be run independently of it.
+        #
+        # Memory is not copied. Instead, this machine's memory is
+        # frozen as a shared base, and both machines get an empty
+        # CowMemory overlay on top of it. (ListMemory and Int64Memory
+        # are compact enough that they are simply copied.) Decoded
+        # instructions and compiled blocks are shared too, so the new
+        # machine does not have to decode or compile the program again;
+        # the compiled blocks are only copied once either machine needs
+        # to change them.
+        #
+        # The new machine does not inherit on_output.
+        memory = self.memory
+        if isinstance(memory, (ListMemory, Int64Memory)):
+            child_memory = type(memory)(memory)
+        else:
+            if isinstance(memory, CowMemory) and \
+               memory.depth >= CowMemory.MAX_DEPTH:
+                memory = memory.flatten()
+            self.memory = CowMemory(memory)
+            child_memory = CowMemory(memory)
+
+        child = Intcode.__new__(Intcode)
+        self._copy_state(child)
+        child.memory = child_memory
+        child.dirty = set(self.dirty)
+        child.inputs = deque(self.inputs)
+        child.outputs = deque(self.outputs)
+        child.on_output = None
+        child.profile = None
+        child.trace = None
+        child.watches = None
+        child.watch_event = None
+        if self.fusion is not None:
+            child.fusion = FusionReport()
+        self.blocks_shared = child.blocks_shared = True
+        return child
+
+    # Names of the attributes that make up a machine, in the order
+    # __init__ sets them (filled in on first use by _copy_state).
+    state_names = None
+
+    def _copy_state(self, other):
+        # Copy every attribute of this machine onto other. This is done
+        # by name rather than through __dict__, because touching an
+        # object's __dict__ turns off CPython's fast attribute access
+        # for it, which slows the interpreter loop noticeably.
+        names = Intcode.state_names
+        if names is None:
+            names = Intcode.state_names = tuple(vars(Intcode([])))
+        for name in names:
+            setattr(other, name, getattr(self, name))
+
+    def snapshot(self):
+        # Capture the state of this machine so that it can be rolled
+        # back to it later with restore(). The snapshot is a fork that
+        # is never run, so taking one costs no more than fork().
+        return self.fork()
+
+    def restore(self, snapshot):
+        # Return this machine to the state captured by snapshot(). The
+        # snapshot itself is left untouched and can be restored again.
+        on_output = self.on_output
+        profile = self.profile
+        fusion = self.fusion
+        trace = self.trace
+        watches = self.watches
+        snapshot.fork()._copy_state(self)
+        self.on_output = on_output
+        self.profile = profile
+        self.fusion = fusion
+        self.trace = trace
+        self.watches = watches
+
+    def enable_profiling(self):
+        # Start collecting execution statistics in self.profile. Until
+        # this is called, run() pays nothing for profiling beyond one
+        # attribute check per call.
+        self.profile = Profile()
+        return self.profile
+
+    def disable_profiling(self):
+        self.profile = None
+
+    def enable_fusion(self):
+        # Execute common instruction pairs and triples (see FUSIONS) as
+        # single superinstructions, and report what fired in
+        # self.fusion. This only affects the interpreter: compiled
+        # blocks already run many instructions per dispatch, and
+        # profiling records instructions one at a time.
+        self.fusion = FusionReport()
+        return self.fusion
+
+    def disable_fusion(self):
+        self.fusion = None
+
+    def enable_tracing(self, size=10000, events=10000, interval=100000,
+                       checkpoints=10):
+        # Start recording a Trace (see there for the parameters) in
+        # self.trace, beginning with a checkpoint of the current state.
+        # Superinstruction fusion is not used while tracing.
+        self.trace = Trace(size, events, interval, checkpoints)
+        self.trace.checkpoint(self)
+        return self.trace
+
+    def disable_tracing(self):
+        self.trace = None
+        if isinstance(self.inputs, TracedInputs):
+            self.inputs = deque(self.inputs)
+
+    def replay(self, count):
+        # Return a new machine in the state this one was in after
+        # "count" instructions, rebuilt from the trace (see
+        # Trace.replay). Any inputs still queued on this machine are
+        # queued on the new one after the recorded ones.
+        if self.trace is None:
+            raise ValueError("tracing is not enabled")
+        return self.trace.replay(count, self.inputs)
+
+    def add_breakpoint(self, pc, handler=None):
+        # Stop (or call handler; see Watchpoints) before executing the
+        # instruction at pc.
+        self._watchpoints().breakpoints[pc] = handler
+
+    def add_opcode_break(self, opcode, handler=None):
+        # Stop before executing any instruction with this opcode, e.g.
+        # Intcode.OP_INPUT.
+        self._watchpoints().opcodes[opcode] = handler
+
+    def add_watchpoint(self, start, end=None, read=False, write=True,
+                       handler=None):
+        # Stop after any instruction that reads (if read is true) or
+        # writes (if write is true) an address from start up to, but
+        # not including, end (or just start, if end is None).
+        watches = self._watchpoints()
+        for addr in range(start, start + 1 if end is None else end):
+            if read:
+                watches.reads[addr] = handler
+            if write:
+                watches.writes[addr] = handler
+
+    def remove_breakpoint(self, pc):
+        if self.watches is not None:
+            self.watches.breakpoints.pop(pc, None)
+            self._drop_watchpoints()
+
+    def remove_opcode_break(self, opcode):
+        if self.watches is not None:
+            self.watches.opcodes.pop(opcode, None)
+            self._drop_watchpoints()
+
+    def remove_watchpoint(self, start, end=None):
+        if self.watches is not None:
+            for addr in range(start, start + 1 if end is None else end):
+                self.watches.reads.pop(addr, None)
+                self.watches.writes.pop(addr, None)
+            self._drop_watchpoints()
+
+    def clear_watchpoints(self):
+        # Remove every breakpoint and watchpoint.
+        self.watches = None
+
+    def _watchpoints(self):
+        if self.watches is None:
+            self.watches = Watchpoints()
+        return self.watches
+
+    def _drop_watchpoints(self):
+        # Go back to the fast run loops once nothing is watched.
+        if not self.watches:
+            self.watches = None
+
+    def reset(self, inputs=[]):
+        # Return the machine to the state it was created in, with the
+        # pristine program loaded and the given inputs queued. Only the
+        # memory cells written since the last reset are restored, so
+        # this is much cheaper than building a new machine when the
+        # same program is run many times.
+        #
+        # Decoded instructions stay cached. Compiled blocks covering a
+        # restored cell are discarded, as for any other write to code.
+        # If the machine is being traced, the trace starts over.
+        program = self.program
+        memory = self.memory
+        for addr in self.dirty:
+            if addr in self.block_addrs:
+                self._invalidate_code(addr)
+            memory[addr] = program[addr] if 0 <= addr < len(program) else 0
+        self.dirty.clear()
+        self.pc = 0
+        self.relative_base = 0
+        self.state = Intcode.RUNNING
+        self.instruction_count = 0
+        self.inputs = deque(inputs)
+        self.outputs.clear()
+        if self.trace is not None:
+            self.trace.restart(self)
+
+    def checkpoint(self):
+        # Return the state of this machine as a checkpoint (see
+        # CHECKPOINT_MAGIC), in bytes. Only the memory cells written
+        # since the machine was created or reset are looked at, so
+        # this is cheap even for a machine that has run for a long
+        # time. Profiling, fusion and tracing are not saved.
+        program = self.program
+        size = len(program)
+        peek = self.peek
+        addrs = []
+        values = []
+        for addr in sorted(self.dirty):
+            value = peek(addr)
+            if value != (program[addr] if 0 <= addr < size else 0):
+                addrs.append(addr)
+                values.append(value)
+        return (CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, self._program_digest(),
+                                       self.instruction_count, self.pc,
+                                       self.relative_base,
+                                       Intcode.STATES.index(self.state)) +
+                pack_words(addrs) + pack_words(values) +
+                pack_words(self.inputs) + pack_words(self.outputs))
+
+    def load_checkpoint(self, data):
+        # Put this machine into the state saved in data by checkpoint().
+        # The checkpoint must have been taken of a machine running the
+        # same program. Memory is reset (see reset()) and the saved
+        # delta written over it, so compiled blocks and decoded
+        # instructions for code that is unchanged are kept. As with
+        # reset(), a trace starts over from the loaded state.
+        magic, digest, count, pc, relative_base, state = \
+            CHECKPOINT_HEADER.unpack_from(data, 0)
+        if magic != CHECKPOINT_MAGIC:
+            raise ValueError("not an Intcode checkpoint")
+        if digest != self._program_digest():
+            raise ValueError("checkpoint is of a different program")
+        addrs, offset = unpack_words(data, CHECKPOINT_HEADER.size)
+        values, offset = unpack_words(data, offset)
+        inputs, offset = unpack_words(data, offset)
+        outputs, offset = unpack_words(data, offset)
+        self.reset(inputs)
+        poke = self.poke
+        for addr, value in zip(addrs, values):
+            poke(addr, value)
+        self.outputs.extend(outputs)
+        self.pc = pc
+        self.relative_base = relative_base
+        self.state = Intcode.STATES[state]
+        self.instruction_count = count
+        if self.trace is not None:
+            self.trace.restart(self)
+
+    def save_checkpoint(self, filename):
+        # Write a checkpoint of this machine to filename. It is written
+        # to a temporary file first and then renamed, so an interrupted
+        # save never leaves a truncated checkpoint behind.
+        temp = filename + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(self.checkpoint())
+        os.replace(temp, filename)
+
+    def resume(self, filename):
+        # Load the checkpoint saved in filename by save_checkpoint().
+        with open(filename, "rb") as f:
+            self.load_checkpoint(f.read())
+
+    def _program_digest(self):
+        digest = self.program_digest
+        if digest is None:
+            digest = self.program_digest = \
+                hashlib.sha1(to_binary(self.program)).digest()
+        return digest
+
+    def promote_memory(self):
+        # Move memory from an Int64Memory, which can't hold a value that
+        # is about to be stored, into a ListMemory, which can.
+        self.memory = ListMemory(self.memory)
 
     def is_running(self):
         return self.state == Intcode.RUNNING
@@ -99,20 +985,105 @@ class Intcode(object):
 
     def poke(self, addr, num, mode=ParameterMode.POSITION):
         if mode == ParameterMode.RELATIVE:
-            self.memory[self.relative_base + addr] = num
-        else:
+            addr = self.relative_base + addr
+        try:
+            self.memory[addr] = num
+        except IndexError:
+            self.memory.grow(addr)
+            try:
+                self.memory[addr] = num
+            except OverflowError:
+                self.promote_memory()
+                self.memory[addr] = num
+        except OverflowError:
+            self.promote_memory()
             self.memory[addr] = num
+        self.dirty.add(addr)
+        if addr in self.decoded:
+            del self.decoded[addr]
+        if addr in self.block_addrs:
+            self._invalidate_code(addr)
 
     def peek(self, addr, mode=ParameterMode.IMMEDIATE):
-        if mode == ParameterMode.POSITION:
-            addr = self.memory[addr]
-        elif mode == ParameterMode.RELATIVE:
-            addr = self.relative_base + self.memory[addr]
-        return self.memory[addr]
+        memory = self.memory
+        try:
+            if mode == ParameterMode.POSITION:
+                return memory[memory[addr]]
+            elif mode == ParameterMode.RELATIVE:
+                return memory[self.relative_base + memory[addr]]
+            return memory[addr]
+        except IndexError:
+            # Only ListMemory raises here: the read went past the end
+            # of the list, so redo it with get(), which returns 0.
+            get = memory.get
+            if mode == ParameterMode.POSITION:
+                addr = get(addr)
+            elif mode == ParameterMode.RELATIVE:
+                addr = self.relative_base + get(addr)
+            return get(addr)
 
     def add_input(self, input_val):
         self.inputs.append(input_val)
 
+    def extend_inputs(self, input_vals):
+        self.inputs.extend(input_vals)
+
+    def drain_outputs(self):
+        # Yield and remove every output queued so far, without running
+        # the machine.
+        outputs = self.outputs
+        while outputs:
+            yield outputs.popleft()
+
+    def iter_outputs(self):
+        # Run the machine, yielding each output as soon as it has been
+        # produced (including any already queued). Stops when the
+        # machine halts or blocks on input; after adding input the
+        # caller may iterate again.
+        yield from self.drain_outputs()
+        while True:
+            result = self.run(break_on_output=1)
+            if result is None:
+                return
+            yield result[0]
+
+    def coroutine(self, arity=1):
+        # Drive the machine as a coroutine. Returns a generator that,
+        # each time it is resumed, runs the machine until it blocks on
+        # input or halts, and yields the outputs produced meanwhile as
+        # a list of tuples of "arity" values each. (A tuple the program
+        # has only partly output is held back until it is complete.)
+        # Values are given to the machine with send(): an int is queued
+        # as one input, anything else as a sequence of inputs. Start it
+        # with next(), which queues nothing.
+        #
+        # When the machine halts, the generator yields its last outputs
+        # and then finishes, so a further send() raises StopIteration.
+        # Outputs that go to on_output are not seen by the generator.
+        #
+        #   io = machine.coroutine(2)
+        #   next(io)
+        #   for color, turn in io.send(0):
+        #       ...
+        while True:
+            self.run()
+            outputs = self.outputs
+            if len(outputs) % arity:
+                values = [outputs.popleft()
+                          for _ in range(0, len(outputs) - len(outputs) % arity)]
+            else:
+                values = list(outputs)
+                outputs.clear()
+            batch = list(zip(*[iter(values)] * arity))
+            if self.state == Intcode.HALTED:
+                yield batch
+                return
+            value = yield batch
+            if isinstance(value, int):
+                self.inputs.append(value)
+            elif value is not None:
+                self.inputs.extend(value)
+
     def step(self):
         # Step through executing one instruction in the Intcode program.
         # Returns the opcode just executed.
@@ -126,8 +1097,14 @@ class Intcode(object):
             # input is available, we're back in business
             self.state = Intcode.RUNNING
 
-        opcode = self.memory[self.pc]
-        inst = Instruction(opcode)
+        try:
+            opcode = self.memory[self.pc]
+        except IndexError:
+            opcode = self.memory.get(self.pc)
+        inst = self.decoded.get(self.pc)
+        if inst is None or inst.word != opcode:
+            inst = Instruction(opcode)
+            self.decoded[self.pc] = inst
 
         param_start = self.pc + 1
         new_pc = self.pc + 1 + inst.param_count
@@ -150,12 +1127,15 @@ class Intcode(object):
             if not self.inputs:
                 self.state = Intcode.BLOCKED
                 return None
-            result = self.inputs.pop(0)
+            result = self.inputs.popleft()
             param1 = self.peek(param_start)
             self.poke(param1, result,         mode=inst.param_mode[0])
         elif inst.opcode == Intcode.OP_OUTPUT:
             param1 = self.peek(param_start,   mode=inst.param_mode[0])
-            self.outputs.append(param1)
+            if self.on_output:
+                self.on_output(param1)
+            else:
+                self.outputs.append(param1)
         elif inst.opcode == Intcode.OP_JMPIF:
             param1 = self.peek(param_start,   mode=inst.param_mode[0])
             param2 = self.peek(param_start+1, mode=inst.param_mode[1])
@@ -185,20 +1165,673 @@ class Intcode(object):
             raise Exception("unknown opcode {}".format(inst.opcode))
 
         self.pc = new_pc
+        self.instruction_count += 1
         return inst.opcode
 
+    def _compile_block(self, pc):
+        # Translate the straight-line run of instructions starting at
+        # pc into a Python function, and return it. Returns None if not
+        # even the first instruction can be compiled, in which case the
+        # caller should fall back to step().
+        #
+        # The generated function takes (machine, memory, inputs, emit,
+        # code, dirty), where emit is called with each output value and
+        # dirty with each address written, and returns the address of
+        # the next instruction to execute. On the way out it adds the
+        # number of instructions it executed to the machine's
+        # instruction_count. Parameter words are baked into the
+        # generated code as constants, which is only valid as long as
+        # the program does not overwrite them: every write checks
+        # whether it hit compiled code and, if so, invalidates the
+        # affected blocks and leaves the block immediately.
+        #
+        # A block ends after any jump, OUTPUT or HALT, so the caller
+        # can check for outputs and state changes between blocks
+        # exactly as run() does between steps. INPUT may appear
+        # anywhere in a block; if no input is available the block
+        # sets the machine BLOCKED and returns the INPUT's address.
+        memory = self.memory
+        dense = isinstance(memory, (ListMemory, Int64Memory))
+
+        def read(mode, k):
+            if mode == ParameterMode.POSITION:
+                if dense and k >= len(memory):
+                    return "get({})".format(k)
+                return "mem[{}]".format(k)
+            elif mode == ParameterMode.RELATIVE:
+                return ("get(rb + {})" if dense else "mem[rb + {}]").format(k)
+            return "({})".format(k)
+
+        def write(mode, k, expr, next_pc, count):
+            if mode == ParameterMode.RELATIVE:
+                target = "rb + {}".format(k)
+            else:
+                target = str(k)
+            lines = ["a = {}".format(target), "v = {}".format(expr)]
+            if dense:
+                # poke() grows the memory, or promotes it if v does
+                # not fit; either way, leave the block, as mem may
+                # have been replaced.
+                lines += ["try:",
+                          "    mem[a] = v",
+                          "except (IndexError, OverflowError):",
+                          "    m.poke(a, v)",
+                          "    " + leave(next_pc, count)]
+            else:
+                lines += ["mem[a] = v"]
+            lines += ["dirty(a)",
+                      "if a in code:",
+                      "    m._invalidate_code(a)",
+                      "    " + leave(next_pc, count)]
+            return lines
+
+        def leave(expr, count):
+            exit = "m.instruction_count += {}; return {}".format(count, expr)
+            if uses_rb:
+                return "m.relative_base = rb; " + exit
+            return exit
+
+        # First pass: decode the instructions that make up the block.
+        insts = []
+        addr = pc
+        while True:
+            try:
+                inst = Instruction(self.peek(addr))
+            except KeyError:
+                break
+            end = addr + 1 + inst.param_count
+            if any(a in self.modified_code for a in range(addr, end)):
+                break
+            params = [self.peek(a) for a in range(addr + 1, end)]
+            insts.append((addr, inst, params))
+            addr = end
+            if inst.opcode in (Intcode.OP_JMPIF, Intcode.OP_JMPIFNOT,
+                               Intcode.OP_OUTPUT, Intcode.OP_HALT):
+                break
+        if not insts:
+            return None
+        block_end = addr
+
+        uses_rb = any(inst.opcode == Intcode.OP_REL or
+                      ParameterMode.RELATIVE in inst.param_mode
+                      for _, inst, _ in insts)
+
+        # Second pass: generate the body.
+        body = []
+        if uses_rb:
+            body.append("rb = m.relative_base")
+        if dense:
+            body.append("get = mem.get")
+        for count, (addr, inst, params) in enumerate(insts, 1):
+            next_pc = addr + 1 + inst.param_count
+            op = inst.opcode
+            modes = inst.param_mode
+            if op in (Intcode.OP_ADD, Intcode.OP_MUL,
+                      Intcode.OP_LT, Intcode.OP_EQ):
+                p1 = read(modes[0], params[0])
+                p2 = read(modes[1], params[1])
+                if op == Intcode.OP_ADD:
+                    expr = "{} + {}".format(p1, p2)
+                elif op == Intcode.OP_MUL:
+                    expr = "{} * {}".format(p1, p2)
+                elif op == Intcode.OP_LT:
+                    expr = "1 if {} < {} else 0".format(p1, p2)
+                else:
+                    expr = "1 if {} == {} else 0".format(p1, p2)
+                body += write(modes[2], params[2], expr, next_pc, count)
+            elif op == Intcode.OP_INPUT:
+                body += ["if not inputs:",
+                         "    m.state = BLOCKED",
+                         "    " + leave(addr, count - 1)]
+                body += write(modes[0], params[0], "inputs.popleft()",
+                              next_pc, count)
+            elif op == Intcode.OP_OUTPUT:
+                body.append("emit({})".format(read(modes[0], params[0])))
+            elif op in (Intcode.OP_JMPIF, Intcode.OP_JMPIFNOT):
+                body.append("if {}{}:".format(
+                    "" if op == Intcode.OP_JMPIF else "not ",
+                    read(modes[0], params[0])))
+                body.append("    " + leave(read(modes[1], params[1]), count))
+            elif op == Intcode.OP_REL:
+                body.append("rb += {}".format(read(modes[0], params[0])))
+            elif op == Intcode.OP_HALT:
+                body.append("m.state = HALTED")
+        body.append(leave(block_end, len(insts)))
+
+        source = "def block(m, mem, inputs, emit, code, dirty):\n" + \
+            "".join("    {}\n".format(line) for line in body)
+        fn = Intcode.compiled_functions.get(source)
+        if fn is None:
+            namespace = {"BLOCKED": Intcode.BLOCKED, "HALTED": Intcode.HALTED}
+            exec(compile(source, "<intcode block {}>".format(pc), "exec"),
+                 namespace)
+            fn = namespace["block"]
+            fn.addrs = [addr for addr, _, _ in insts]
+            fn.opcodes = [inst.opcode for _, inst, _ in insts]
+            if len(Intcode.compiled_functions) >= Intcode.MAX_COMPILED_FUNCTIONS:
+                Intcode.compiled_functions.clear()
+            Intcode.compiled_functions[source] = fn
+
+        self._own_blocks()
+        self.blocks[pc] = fn
+        self.block_ends[pc] = block_end
+        for a in range(pc, block_end):
+            self.block_addrs[a] = self.block_addrs.get(a, frozenset()) | {pc}
+        return fn
+
+    def _fuse(self, pc):
+        # Peephole pass at pc: if the instructions starting there match
+        # one of FUSIONS (the longest match wins), build a function
+        # that executes them in one go, record it in self.fused and
+        # return the entry. Otherwise record and return None.
+        #
+        # The generated function takes (machine, memory, pc, emit,
+        # dirty) and returns the address of the next instruction, like
+        # a compiled block. Unlike a compiled block, only opcode words
+        # are baked in; parameters are read from memory when it runs,
+        # so the function depends only on the opcode words and is
+        # shared by every address (and machine) with the same
+        # sequence. A write into the superinstruction's own span ends
+        # it after the writing instruction, so that the rest is
+        # decoded afresh.
+        insts = []
+        addr = pc
+        for _ in range(0, Intcode.MAX_FUSION):
+            try:
+                inst = Instruction(self.peek(addr))
+            except KeyError:
+                break
+            insts.append((addr, inst))
+            addr += 1 + inst.param_count
+            if inst.opcode in (Intcode.OP_JMPIF, Intcode.OP_JMPIFNOT,
+                               Intcode.OP_OUTPUT, Intcode.OP_HALT):
+                break
+        while insts and tuple(i.opcode for _, i in insts) not in Intcode.FUSIONS:
+            insts.pop()
+        if not insts:
+            self.fused[pc] = None
+            return None
+
+        dense = isinstance(self.memory, (ListMemory, Int64Memory))
+        words = tuple(inst.word for _, inst in insts)
+        fn = Intcode.fused_functions.get((words, dense))
+        if fn is None:
+            fn = self._build_superinstruction([inst for _, inst in insts], dense)
+            Intcode.fused_functions[(words, dense)] = fn
+        entry = (tuple((a, inst.word) for a, inst in insts), fn)
+        self.fused[pc] = entry
+        if self.fusion is not None:
+            self.fusion.sites += 1
+        return entry
+
+    def _build_superinstruction(self, insts, dense):
+        # Generate the function for _fuse. Parameter k of the
+        # instruction at offset o from pc is the word at pc + o + 1 + k.
+        end = sum(1 + inst.param_count for inst in insts)
+        uses_rb = any(inst.opcode == Intcode.OP_REL or
+                      ParameterMode.RELATIVE in inst.param_mode
+                      for inst in insts)
+
+        def read(mode, k):
+            word = "mem[pc + {}]".format(k)
+            if mode == ParameterMode.IMMEDIATE:
+                return word
+            if mode == ParameterMode.RELATIVE:
+                word = "rb + " + word
+            return ("get({})" if dense else "mem[{}]").format(word)
+
+        def leave(expr, count):
+            exit = "m.instruction_count += {}; return {}".format(count, expr)
+            if uses_rb:
+                return "m.relative_base = rb; " + exit
+            return exit
+
+        body = []
+        if uses_rb:
+            body.append("rb = m.relative_base")
+        if dense:
+            body.append("get = mem.get")
+        offset = 0
+        for count, inst in enumerate(insts, 1):
+            op = inst.opcode
+            modes = inst.param_mode
+            k = offset + 1
+            next_offset = offset + 1 + inst.param_count
+            if op in (Intcode.OP_ADD, Intcode.OP_MUL,
+                      Intcode.OP_LT, Intcode.OP_EQ):
+                p1 = read(modes[0], k)
+                p2 = read(modes[1], k + 1)
+                if op == Intcode.OP_ADD:
+                    expr = "{} + {}".format(p1, p2)
+                elif op == Intcode.OP_MUL:
+                    expr = "{} * {}".format(p1, p2)
+                elif op == Intcode.OP_LT:
+                    expr = "1 if {} < {} else 0".format(p1, p2)
+                else:
+                    expr = "1 if {} == {} else 0".format(p1, p2)
+                target = "mem[pc + {}]".format(k + 2)
+                if modes[2] == ParameterMode.RELATIVE:
+                    target = "rb + " + target
+                body += ["a = {}".format(target), "v = {}".format(expr)]
+                if dense:
+                    # As in _compile_block
+                    body += ["try:",
+                             "    mem[a] = v",
+                             "except (IndexError, OverflowError):",
+                             "    m.poke(a, v)",
+                             "    " + leave("pc + {}".format(next_offset), count)]
+                else:
+                    body += ["mem[a] = v"]
+                body += ["dirty(a)"]
+                if count < len(insts):
+                    body += ["if pc <= a < pc + {}:".format(end),
+                             "    " + leave("pc + {}".format(next_offset), count)]
+            elif op == Intcode.OP_OUTPUT:
+                body.append("emit({})".format(read(modes[0], k)))
+            elif op in (Intcode.OP_JMPIF, Intcode.OP_JMPIFNOT):
+                body.append("if {}{}:".format(
+                    "" if op == Intcode.OP_JMPIF else "not ",
+                    read(modes[0], k)))
+                body.append("    " + leave(read(modes[1], k + 1), count))
+            elif op == Intcode.OP_REL:
+                body.append("rb += {}".format(read(modes[0], k)))
+            offset = next_offset
+        body.append(leave("pc + {}".format(end), len(insts)))
+
+        source = "def superinstruction(m, mem, pc, emit, dirty):\n" + \
+            "".join("    {}\n".format(line) for line in body)
+        namespace = {}
+        exec(compile(source, "<intcode superinstruction>", "exec"), namespace)
+        fn = namespace["superinstruction"]
+        fn.opcodes = [inst.opcode for inst in insts]
+        fn.name = "+".join(inst.name for inst in insts)
+        return fn
+
+    def _invalidate_code(self, addr):
+        # The program wrote to addr, which is covered by compiled code.
+        # Discard every block covering it and remember that the address
+        # is self-modified, so it is interpreted rather than recompiled.
+        self._own_blocks()
+        self.modified_code.add(addr)
+        for start in self.block_addrs.pop(addr, ()):
+            del self.blocks[start]
+            for a in range(start, self.block_ends.pop(start)):
+                starts = self.block_addrs.get(a)
+                if starts and start in starts:
+                    starts = starts - {start}
+                    if starts:
+                        self.block_addrs[a] = starts
+                    else:
+                        del self.block_addrs[a]
+
+    def _own_blocks(self):
+        # Give this machine its own copy of the compiled blocks, if it
+        # is sharing them with a forked machine, before changing them.
+        # The sets in block_addrs are frozensets, and are replaced
+        # rather than modified, so a shallow copy is enough.
+        if self.blocks_shared:
+            self.blocks = self.blocks.copy()
+            self.block_ends = self.block_ends.copy()
+            self.block_addrs = self.block_addrs.copy()
+            self.modified_code = self.modified_code.copy()
+            self.blocks_shared = False
+
+    def _run_compiled(self, break_on_output=0):
+        # Equivalent to the interpreter loop in run(), but executes a
+        # compiled block per iteration instead of a single step.
+        while True:
+            if self.state != Intcode.RUNNING:
+                if self.is_halted() or not self.inputs:
+                    return None
+                self.state = Intcode.RUNNING
+            fn = self.blocks.get(self.pc)
+            if fn is None:
+                fn = self._compile_block(self.pc)
+            if fn is None:
+                self.step()
+            else:
+                self.pc = fn(self, self.memory, self.inputs,
+                             self.on_output or self.outputs.append,
+                             self.block_addrs, self.dirty.add)
+            if break_on_output and len(self.outputs) >= break_on_output:
+                popleft = self.outputs.popleft
+                return [popleft() for _ in range(break_on_output)]
+            if not self.is_running():
+                # Machine is blocked or halted
+                break
+        return None
+
+    def _run_profiled(self, break_on_output=0):
+        # Equivalent to run() (in either mode), but records every
+        # instruction executed in self.profile.
+        profile = self.profile
+        start = time.perf_counter()
+        start_count = self.instruction_count
+        if profile.blocked_since is not None and self.inputs:
+            profile.blocked_time += start - profile.blocked_since
+            profile.blocked_since = None
+        try:
+            while True:
+                if self.state != Intcode.RUNNING:
+                    if self.is_halted() or not self.inputs:
+                        return None
+                    self.state = Intcode.RUNNING
+                pc = self.pc
+                count = self.instruction_count
+                fn = None
+                if self.compiled:
+                    fn = self.blocks.get(pc) or self._compile_block(pc)
+                if fn is None:
+                    # Use the opcode step() reports: if the instruction
+                    # overwrote itself, its decoded entry is gone.
+                    opcode = self.step()
+                    if self.instruction_count > count:
+                        profile.record(pc, opcode)
+                else:
+                    self.pc = fn(self, self.memory, self.inputs,
+                                 self.on_output or self.outputs.append,
+                                 self.block_addrs, self.dirty.add)
+                    profile.record_block(fn, self.instruction_count - count)
+                if break_on_output and len(self.outputs) >= break_on_output:
+                    popleft = self.outputs.popleft
+                    return [popleft() for _ in range(break_on_output)]
+                if not self.is_running():
+                    # Machine is blocked or halted
+                    break
+            return None
+        finally:
+            now = time.perf_counter()
+            profile.run_time += now - start
+            profile.instructions += self.instruction_count - start_count
+            if self.is_blocked() and profile.blocked_since is None:
+                profile.blocked_since = now
+
+    def _run_fused(self, break_on_output=0):
+        # Equivalent to the interpreter loop in run(), but executes a
+        # superinstruction wherever one matches instead of a single step.
+        fused = self.fused
+        fusion = self.fusion
+        while True:
+            if self.state != Intcode.RUNNING:
+                if self.is_halted() or not self.inputs:
+                    return None
+                self.state = Intcode.RUNNING
+            pc = self.pc
+            entry = fused.get(pc, False)
+            if entry is False:
+                entry = self._fuse(pc)
+            memory = self.memory
+            if entry is not None:
+                guards, fn = entry
+                for a, word in guards:
+                    if memory[a] != word:
+                        # The code has changed since it was fused
+                        del fused[pc]
+                        entry = None
+                        break
+            if entry is None:
+                self.step()
+            else:
+                count = self.instruction_count
+                self.pc = fn(self, memory, pc,
+                             self.on_output or self.outputs.append,
+                             self.dirty.add)
+                fusion.record(fn, self.instruction_count - count)
+            if break_on_output and len(self.outputs) >= break_on_output:
+                popleft = self.outputs.popleft
+                return [popleft() for _ in range(break_on_output)]
+            if not self.is_running():
+                # Machine is blocked or halted
+                break
+        return None
+
+    def _run_traced(self, break_on_output=0):
+        # Equivalent to run() (interpreted or compiled), but records
+        # every dispatch, input and output in self.trace, and takes
+        # checkpoints as it goes.
+        trace = self.trace
+        record = trace.instructions.append
+        if not isinstance(self.inputs, TracedInputs) or self.inputs.machine is not self:
+            self.inputs = TracedInputs(self.inputs, self)
+        emit_to = self.on_output or self.outputs.append
+
+        def emit(value):
+            trace.record_event(self.instruction_count, Trace.OUTPUT, value)
+            emit_to(value)
+
+        on_output = self.on_output
+        self.on_output = emit
+        try:
+            while True:
+                if self.state != Intcode.RUNNING:
+                    if self.is_halted() or not self.inputs:
+                        return None
+                    self.state = Intcode.RUNNING
+                pc = self.pc
+                record((self.instruction_count, pc))
+                fn = None
+                if self.compiled:
+                    fn = self.blocks.get(pc) or self._compile_block(pc)
+                if fn is None:
+                    self.step()
+                else:
+                    self.pc = fn(self, self.memory, self.inputs, emit,
+                                 self.block_addrs, self.dirty.add)
+                if self.instruction_count >= trace.next_checkpoint:
+                    trace.checkpoint(self)
+                if break_on_output and len(self.outputs) >= break_on_output:
+                    popleft = self.outputs.popleft
+                    return [popleft() for _ in range(break_on_output)]
+                if not self.is_running():
+                    # Machine is blocked or halted
+                    break
+            return None
+        finally:
+            self.on_output = on_output
+
+    def _run_watched(self, break_on_output=0):
+        # Equivalent to the interpreter loop in run(), but checks every
+        # instruction against self.watches first. Compiled blocks and
+        # superinstructions are not used, as they would skip the checks,
+        # and nothing is profiled or traced.
+        watches = self.watches
+        breakpoints = watches.breakpoints
+        opcodes = watches.opcodes
+        reads = watches.reads
+        writes = watches.writes
+        self.watch_event = None
+        while True:
+            if self.state != Intcode.RUNNING:
+                if self.is_halted() or not self.inputs:
+                    return None
+                self.state = Intcode.RUNNING
+            pc = self.pc
+            word = self.peek(pc)
+            inst = self.decoded.get(pc)
+            if inst is None or inst.word != word:
+                inst = Instruction(word)
+            # When resuming from a stop at pc, don't stop there again
+            if pc != watches.resume_pc:
+                if pc in breakpoints:
+                    event = (Watchpoints.BREAK, pc, pc, None)
+                    if self._watch_hit(breakpoints[pc], event):
+                        watches.resume_pc = pc
+                        return None
+                if inst.opcode in opcodes:
+                    event = (Watchpoints.OPCODE, pc, inst.opcode, None)
+                    if self._watch_hit(opcodes[inst.opcode], event):
+                        watches.resume_pc = pc
+                        return None
+            if reads or writes:
+                read_addrs, write_addr = watches.accesses(self, inst)
+            else:
+                read_addrs, write_addr = (), None
+            self.step()
+            if self.state == Intcode.BLOCKED:
+                # The INPUT didn't run, so nothing was accessed, and a
+                # stop here has still not been resumed past
+                return None
+            watches.resume_pc = None
+            stop = False
+            for addr in read_addrs:
+                if addr in reads:
+                    event = (Watchpoints.READ, pc, addr, self.peek(addr))
+                    stop = self._watch_hit(reads[addr], event) or stop
+            if write_addr in writes:
+                event = (Watchpoints.WRITE, pc, write_addr, self.peek(write_addr))
+                stop = self._watch_hit(writes[write_addr], event) or stop
+            if break_on_output and len(self.outputs) >= break_on_output:
+                popleft = self.outputs.popleft
+                return [popleft() for _ in range(break_on_output)]
+            if stop or not self.is_running():
+                # Stopped by a watchpoint, or blocked or halted
+                break
+        return None
+
+    def _watch_hit(self, handler, event):
+        # Report event to handler; return whether to stop.
+        if handler is not None and not handler(self, event):
+            return False
+        self.watch_event = event
+        return True
+
+    def run_slice(self, count):
+        # Run for about "count" instructions, stopping early if the
+        # machine blocks on input or halts, and return the number of
+        # instructions executed. Outputs are handled as by run(). This
+        # is for callers that have to share the CPU, like AsyncIntcode:
+        # compiled blocks are run whole, so a slice can run over by up
+        # to one block, and profiling, tracing, fusion and watchpoints
+        # are not applied.
+        start = self.instruction_count
+        limit = start + count
+        while self.instruction_count < limit:
+            if self.state != Intcode.RUNNING:
+                if self.is_halted() or not self.inputs:
+                    break
+                self.state = Intcode.RUNNING
+            fn = None
+            if self.compiled:
+                fn = self.blocks.get(self.pc) or self._compile_block(self.pc)
+            if fn is None:
+                self.step()
+            else:
+                self.pc = fn(self, self.memory, self.inputs,
+                             self.on_output or self.outputs.append,
+                             self.block_addrs, self.dirty.add)
+            if not self.is_running():
+                break
+        return self.instruction_count - start
+
     def run(self, break_on_output=0):
         # Run an Intcode program.
         # If break_on_output is nonzero, return outputs as soon as
         # this many outputs has been received.
         # If the program halts, return None.
+        if self.watches is not None:
+            return self._run_watched(break_on_output)
+        if self.profile is not None:
+            return self._run_profiled(break_on_output)
+        if self.trace is not None:
+            return self._run_traced(break_on_output)
+        if self.compiled:
+            return self._run_compiled(break_on_output)
+        if self.fusion is not None:
+            return self._run_fused(break_on_output)
         while True:
             self.step()
             if break_on_output and len(self.outputs) >= break_on_output:
-                result = self.outputs[0:break_on_output]
-                self.outputs = self.outputs[break_on_output:]
-                return result
+                popleft = self.outputs.popleft
+                return [popleft() for _ in range(break_on_output)]
             if not self.is_running():
                 # Machine is blocked or halted
                 break
         return None
+
+
+class Network(object):
+    # A set of named Intcode machines whose outputs are wired to each
+    # other's inputs.
+    #
+    # connect(src, dst) routes every output of machine src onto the
+    # input queue of machine dst (an output is copied to each machine
+    # src is connected to). A machine with no connections keeps its
+    # outputs on its own output queue.
+    #
+    # The scheduler is event-driven: a machine is only dispatched when
+    # it can make progress, i.e. it is RUNNING, or BLOCKED with input
+    # waiting. A dispatched machine runs until it blocks or halts, and
+    # a blocked machine is put back on the ready queue only when a
+    # value is delivered to it. There is no polling of idle machines,
+    # so the cost of scheduling is proportional to the number of
+    # messages exchanged, not to the number of machines.
+
+    # Network states, as returned by run()
+    HALTED  = "HALTED"    # Every machine has halted
+    BLOCKED = "BLOCKED"   # Some machines are waiting on input that no
+                          # machine will send (deadlocked, or idle until
+                          # the caller sends more input)
+
+    def __init__(self):
+        self.machines = {}
+        self.links = defaultdict(list)
+        self.last_outputs = {}
+        self.ready = deque()
+        self.queued = set()
+
+    def add_machine(self, name, machine):
+        self.machines[name] = machine
+        self.wake(name)
+        return machine
+
+    def connect(self, src, dst):
+        if not self.links[src]:
+            self.machines[src].on_output = self._router(src)
+        self.links[src].append(dst)
+
+    def _router(self, src):
+        # Build the on_output callback for machine src.
+        links = self.links[src]
+        last_outputs = self.last_outputs
+        machines = self.machines
+
+        def route(value):
+            last_outputs[src] = value
+            for dst in links:
+                machines[dst].add_input(value)
+                self.wake(dst)
+        return route
+
+    def send(self, name, value):
+        # Deliver a value from outside the network to machine name.
+        self.machines[name].add_input(value)
+        self.wake(name)
+
+    def wake(self, name):
+        # Queue machine name for dispatch if it can make progress and
+        # is not queued already.
+        if name in self.queued:
+            return
+        machine = self.machines[name]
+        if machine.is_running() or (machine.is_blocked() and machine.inputs):
+            self.ready.append(name)
+            self.queued.add(name)
+
+    def run(self):
+        # Run machines until none of them can make progress. Returns
+        # Network.HALTED if every machine has halted, otherwise
+        # Network.BLOCKED.
+        ready = self.ready
+        while ready:
+            name = ready.popleft()
+            self.queued.discard(name)
+            self.machines[name].run()
+        if all(m.is_halted() for m in self.machines.values()):
+            return Network.HALTED
+        return Network.BLOCKED
+
+    def blocked_machines(self):
+        return [name for name, m in self.machines.items() if m.is_blocked()]
+
+    def instruction_counts(self):
+        return {name: m.instruction_count for name, m in self.machines.items()}
@@ -0,0 +1,224 @@
+#! /usr/bin/env python3
+
+# Running Intcode machines as asyncio tasks.
+#
+# AsyncIntcode wraps an intcode.Intcode so that it can run alongside
+# other coroutines in an event loop: instead of the machine's own
+# input and output deques, INPUT instructions take values from an
+# asyncio.Queue (awaiting it while the machine is blocked) and outputs
+# are put on another, so machines can be wired to each other, or to
+# anything else, through queues.
+#
+# The machine runs in slices of about slice_size instructions (see
+# Intcode.run_slice), and control goes back to the event loop after
+# every slice, so a machine with a lot to compute does not hold up the
+# others. A slice runs on the event loop's own thread unless an
+# executor is given:
+#
+#   ThreadPoolExecutor   the slice runs in a worker thread, so the loop
+#                        keeps running meanwhile (though it still
+#                        shares the GIL with the slice)
+#   ProcessPoolExecutor  the machine is sent to a worker process as a
+#                        checkpoint (see Intcode.checkpoint), runs the
+#                        slice there and is sent back the same way;
+#                        this only pays off for large slices
+#
+# Each AsyncIntcode keeps statistics on how it ran, including the
+# latency of each response: the time from input arriving until the
+# machine has dealt with it, i.e. blocked for more input or halted.
+#
+# Usage (runs every day 7 feedback loop concurrently):
+#   ./intcode_async.py [--slice N] [--executor thread|process]
+
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import sys
+import time
+
+from collections import deque
+
+from intcode import Intcode, load_program
+
+
+class AsyncIntcode(object):
+
+    def __init__(self, machine, inputs=None, outputs=None, slice_size=10000,
+                 executor=None):
+        # inputs and outputs are asyncio.Queues, new ones by default.
+        # Anything already queued on the machine's own inputs is used
+        # first. The machine's on_output must not be set, or outputs
+        # never reach the queue.
+        self.machine = machine
+        self.inputs = asyncio.Queue() if inputs is None else inputs
+        self.outputs = asyncio.Queue() if outputs is None else outputs
+        self.slice_size = slice_size
+        self.executor = executor
+
+        self.slices = 0
+        self.run_time = 0.0        # Seconds spent running slices
+        self.longest_slice = 0.0   # Seconds taken by the longest slice
+        self.blocked_time = 0.0    # Seconds spent awaiting input
+        self.latencies = deque(maxlen=10000)   # Seconds, per response
+
+    async def run(self):
+        # Run the machine until it halts, and return it.
+        machine = self.machine
+        loop = asyncio.get_running_loop()
+        received = None   # When the input being dealt with arrived
+        while not machine.is_halted():
+            if machine.is_blocked() and not machine.inputs:
+                if received is not None:
+                    self.latencies.append(time.perf_counter() - received)
+                start = time.perf_counter()
+                machine.add_input(await self.inputs.get())
+                while not self.inputs.empty():
+                    machine.add_input(self.inputs.get_nowait())
+                received = time.perf_counter()
+                self.blocked_time += received - start
+
+            start = time.perf_counter()
+            await self._run_slice(loop)
+            elapsed = time.perf_counter() - start
+            self.slices += 1
+            self.run_time += elapsed
+            self.longest_slice = max(self.longest_slice, elapsed)
+
+            outputs = machine.outputs
+            while outputs:
+                await self.outputs.put(outputs.popleft())
+            if self.executor is None:
+                # Let the other tasks have a turn
+                await asyncio.sleep(0)
+        if received is not None:
+            self.latencies.append(time.perf_counter() - received)
+        return machine
+
+    async def _run_slice(self, loop):
+        machine = self.machine
+        executor = self.executor
+        if executor is None:
+            machine.run_slice(self.slice_size)
+        elif isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            checkpoint = await loop.run_in_executor(
+                executor, _run_slice_in_process, machine.program,
+                machine.compiled, machine.checkpoint(), self.slice_size)
+            machine.load_checkpoint(checkpoint)
+        else:
+            await loop.run_in_executor(executor, machine.run_slice,
+                                       self.slice_size)
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        return {
+            "instructions": self.machine.instruction_count,
+            "slices": self.slices,
+            "run_time": self.run_time,
+            "longest_slice": self.longest_slice,
+            "blocked_time": self.blocked_time,
+            "responses": len(latencies),
+            "mean_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+            "median_latency": latencies[len(latencies) // 2] if latencies else 0.0,
+            "max_latency": latencies[-1] if latencies else 0.0,
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+
+# Machines built by _run_slice_in_process in a worker process, indexed
+# by program and compiled flag, so that each worker only builds (and
+# compiles) a program once however many slices it runs.
+_worker_machines = {}
+
+
+def _run_slice_in_process(program, compiled, checkpoint, count):
+    machine = _worker_machines.get((program, compiled))
+    if machine is None:
+        machine = Intcode(program, compiled=compiled)
+        _worker_machines[(program, compiled)] = machine
+    machine.load_checkpoint(checkpoint)
+    machine.run_slice(count)
+    return machine.checkpoint()
+
+
+async def feedback_loop(program, phase_settings, slice_size, executor):
+    # Run one day 7 feedback loop: five amplifiers in a ring, each
+    # feeding the next through a queue. Returns the last signal and
+    # the amplifiers.
+    queues = [asyncio.Queue() for _ in phase_settings]
+    amps = []
+    for i, phase in enumerate(phase_settings):
+        amps.append(AsyncIntcode(Intcode(program, [phase]), queues[i],
+                                 queues[(i + 1) % len(queues)],
+                                 slice_size, executor))
+    queues[0].put_nowait(0)
+    await asyncio.gather(*(amp.run() for amp in amps))
+    # The last amplifier's final signal is left in the first one's queue
+    last = None
+    while not queues[0].empty():
+        last = queues[0].get_nowait()
+    return last, amps
+
+
+async def ticker(interval, lags, done):
+    # Stand-in for the rest of a service: wake up every interval and
+    # record how late each wake-up was.
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def demo(slice_size, executor):
+    program = load_program("adv7_input.txt")
+    lags = []
+    done = asyncio.Event()
+    tick = asyncio.ensure_future(ticker(0.001, lags, done))
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        feedback_loop(program, phases, slice_size, executor)
+        for phases in itertools.permutations(range(5, 10))))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick
+
+    amps = [amp for _, loop_amps in results for amp in loop_amps]
+    stats = [amp.as_dict() for amp in amps]
+    print("best signal      {}".format(max(signal for signal, _ in results)))
+    print("machines         {}".format(len(amps)))
+    print("elapsed          {:.3f}s".format(elapsed))
+    print("instructions     {}".format(sum(s["instructions"] for s in stats)))
+    print("slices           {}".format(sum(s["slices"] for s in stats)))
+    print("longest slice    {:.6f}s".format(max(s["longest_slice"] for s in stats)))
+    print("mean latency     {:.6f}s".format(
+        sum(s["mean_latency"] for s in stats) / len(stats)))
+    print("max latency      {:.6f}s".format(max(s["max_latency"] for s in stats)))
+    print("max loop lag     {:.6f}s".format(max(lags) if lags else 0.0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the day 7 feedback loops as concurrent asyncio tasks.")
+    parser.add_argument("--slice", type=int, default=10000,
+                        help="instructions per slice (default: 10000)")
+    parser.add_argument("--executor", choices=["thread", "process"],
+                        help="run slices in a thread or process pool")
+    args = parser.parse_args(argv)
+
+    executor = None
+    if args.executor == "thread":
+        executor = concurrent.futures.ThreadPoolExecutor()
+    elif args.executor == "process":
+        executor = concurrent.futures.ProcessPoolExecutor()
+    try:
+        asyncio.run(demo(args.slice, executor))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
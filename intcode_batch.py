@@ -0,0 +1,312 @@
+#! /usr/bin/env python3
+
+# Lockstep execution of many copies of one Intcode program with NumPy.
+#
+# Sweeps such as adv2's noun/verb search run the same program over and
+# over with different inputs. BatchIntcode holds the state of N such
+# machines ("lanes") as arrays -- an N x width memory matrix and pc,
+# relative base and state vectors -- and executes them together: each
+# step fetches every running lane's opcode, groups the lanes by opcode
+# and carries out each group's instruction with a handful of array
+# operations. Lanes that take different branches simply end up in
+# different groups on later steps.
+#
+# Anything the arrays cannot represent is handed to the scalar
+# interpreter: a lane that addresses memory outside the matrix, meets
+# an opcode or parameter mode it doesn't know, or computes a value
+# that might not fit in 64 bits is converted into an intcode.Intcode
+# in the same state, which finishes the run on its own. Such lanes are
+# expected to be rare; the answers are the same either way.
+#
+# Each lane's inputs are fixed when the batch is created. A lane that
+# runs out of input is left BLOCKED; machine(lane) returns an Intcode in
+# the same state, which can be given more input and run on its own.
+#
+# NumPy is optional: the rest of the repository does not need it, and
+# BatchIntcode raises ImportError when it is created without it.
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from intcode import Intcode, ListMemory, ParameterMode
+
+
+class BatchIntcode(object):
+
+    # Lane states. RUNNING, BLOCKED and HALTED are those of Intcode;
+    # SCALAR lanes have been handed over to an Intcode (see machines)
+    # which has yet to run, and FAILED lanes stopped with an error (see
+    # errors). A lane that was handed over keeps its machine, and peek()
+    # and machine() read from it, but its state reflects how it ended.
+    RUNNING = 0
+    BLOCKED = 1
+    HALTED  = 2
+    SCALAR  = 3
+    FAILED  = 4
+
+    # Results of ADD and MUL are only computed in the arrays while the
+    # operands are below this in magnitude, which rules out overflow.
+    SAFE_ADD = 2**62
+    SAFE_MUL = 2**31
+
+    def __init__(self, data, count, inputs=None, memory_size=None):
+        # Create count lanes, each loaded with the program in data.
+        # inputs, if given, is a list of count input lists, one per
+        # lane. memory_size is the width of each lane's memory (by
+        # default the program plus 1024 words); lanes that go beyond
+        # it fall back to the scalar interpreter.
+        if np is None:
+            raise ImportError("BatchIntcode needs numpy")
+        self.program = tuple(data)
+        self.count = count
+        width = memory_size or len(data) + 1024
+        self.width = width
+        self.pristine = np.zeros(width, dtype=np.int64)
+        self.pristine[0:len(data)] = data
+        self.memory = np.tile(self.pristine, (count, 1))
+        self.pc = np.zeros(count, dtype=np.int64)
+        self.relative_base = np.zeros(count, dtype=np.int64)
+        self.state = np.full(count, BatchIntcode.RUNNING, dtype=np.int8)
+        self.instruction_count = np.zeros(count, dtype=np.int64)
+
+        # Inputs are a count x n matrix, padded with zeros, and the
+        # number of inputs each lane has and has consumed.
+        inputs = inputs or [[] for _ in range(0, count)]
+        longest = max([len(i) for i in inputs] + [1])
+        self.inputs = np.zeros((count, longest), dtype=np.int64)
+        for lane, values in enumerate(inputs):
+            self.inputs[lane, 0:len(values)] = values
+        self.input_count = np.array([len(i) for i in inputs], dtype=np.int64)
+        self.input_pos = np.zeros(count, dtype=np.int64)
+
+        self.outputs = [[] for _ in range(0, count)]
+        self.machines = {}   # Lane to the Intcode running it, for SCALAR lanes
+        self.errors = {}     # Lane to the exception that stopped it, for FAILED lanes
+        self.lockstep_steps = 0
+
+    def poke(self, addr, values):
+        # Write values (one per lane, or a single value for every
+        # lane) to addr in each lane's memory. Only for use before run().
+        self.memory[:, addr] = values
+
+    def peek(self, addr):
+        # Return a list of the value at addr in each lane's memory.
+        if 0 <= addr < self.width:
+            values = self.memory[:, addr].tolist()
+        else:
+            values = [0] * self.count
+        for lane, machine in self.machines.items():
+            values[lane] = machine.peek(addr)
+        return values
+
+    def run(self):
+        # Run every lane until it halts, blocks on input or fails, then
+        # finish any lanes that fell back to the scalar interpreter.
+        while self.step():
+            pass
+        for lane, machine in self.machines.items():
+            if self.state[lane] != BatchIntcode.SCALAR:
+                continue
+            try:
+                machine.run()
+            except (KeyError, IndexError) as e:
+                self.errors[lane] = e
+                self.state[lane] = BatchIntcode.FAILED
+                continue
+            if machine.is_halted():
+                self.state[lane] = BatchIntcode.HALTED
+            elif machine.is_blocked():
+                self.state[lane] = BatchIntcode.BLOCKED
+
+    def step(self):
+        # Execute one instruction in every running lane. Returns the
+        # number of lanes that were running.
+        lanes = np.flatnonzero(self.state == BatchIntcode.RUNNING)
+        if len(lanes) == 0:
+            return 0
+        self.lockstep_steps += 1
+
+        # Lanes whose pc has run off the memory matrix can't even be
+        # decoded here.
+        outside = self.pc[lanes] >= self.width - 4
+        outside |= self.pc[lanes] < 0
+        if outside.any():
+            self._fall_back(lanes[outside])
+            lanes = lanes[~outside]
+
+        words = self.memory[lanes, self.pc[lanes]]
+        opcodes = words % 100
+        for opcode in np.unique(opcodes).tolist():
+            selected = opcodes == opcode
+            group, group_words = lanes[selected], words[selected]
+            handler = BatchIntcode.HANDLERS.get(opcode)
+            if handler is None or (group_words < 0).any():
+                self._fall_back(group)
+                continue
+            handler(self, group, group_words)
+        return len(lanes)
+
+    def _params(self, lanes, words, count):
+        # Decode count parameters of the instruction at each lane's pc.
+        # Returns (values, addrs, ok): for each parameter, the value it
+        # reads and the address it refers to (meaningless in lanes
+        # where it is in immediate mode), and a mask of the lanes whose
+        # parameters can all be handled here.
+        memory = self.memory
+        pc = self.pc[lanes]
+        rb = self.relative_base[lanes]
+        ok = np.ones(len(lanes), dtype=bool)
+        values = []
+        addrs = []
+        modes = words // 100
+        for i in range(0, count):
+            mode = modes % 10
+            modes = modes // 10
+            raw = memory[lanes, pc + 1 + i]
+            addr = np.where(mode == ParameterMode.RELATIVE, rb + raw, raw)
+            immediate = mode == ParameterMode.IMMEDIATE
+            ok &= (mode <= ParameterMode.RELATIVE)
+            ok &= immediate | ((addr >= 0) & (addr < self.width))
+            safe = np.clip(addr, 0, self.width - 1)
+            values.append(np.where(immediate, raw, memory[lanes, safe]))
+            addrs.append(addr)
+        return values, addrs, ok
+
+    def _write_params(self, lanes, words, count):
+        # As _params, for an instruction whose last parameter is written
+        # to. Writes in immediate mode are left to the scalar
+        # interpreter.
+        values, addrs, ok = self._params(lanes, words, count)
+        ok &= (words // 10**(count + 1)) % 10 != ParameterMode.IMMEDIATE
+        return values, addrs, ok
+
+    def _split(self, lanes, words, ok, *arrays):
+        # Send the lanes not in ok to the scalar interpreter, and return
+        # the rest along with the matching elements of arrays.
+        if not ok.all():
+            self._fall_back(lanes[~ok])
+            lanes = lanes[ok]
+            words = words[ok]
+            arrays = [a[ok] for a in arrays]
+        return (lanes, words) + tuple(arrays)
+
+    def _arith(self, lanes, words, opcode):
+        (x, y, _), (_, _, addr), ok = self._write_params(lanes, words, 3)
+        # Comparisons can't overflow, so only ADD and MUL limit operands
+        if opcode in (Intcode.OP_ADD, Intcode.OP_MUL):
+            limit = BatchIntcode.SAFE_ADD if opcode == Intcode.OP_ADD else BatchIntcode.SAFE_MUL
+            ok &= (np.abs(x) < limit) & (np.abs(y) < limit)
+        lanes, words, x, y, addr = self._split(lanes, words, ok, x, y, addr)
+        if opcode == Intcode.OP_ADD:
+            result = x + y
+        elif opcode == Intcode.OP_MUL:
+            result = x * y
+        elif opcode == Intcode.OP_LT:
+            result = (x < y).astype(np.int64)
+        else:
+            result = (x == y).astype(np.int64)
+        self.memory[lanes, addr] = result
+        self.pc[lanes] += 4
+        self.instruction_count[lanes] += 1
+
+    def _add(self, lanes, words):
+        self._arith(lanes, words, Intcode.OP_ADD)
+
+    def _mul(self, lanes, words):
+        self._arith(lanes, words, Intcode.OP_MUL)
+
+    def _lt(self, lanes, words):
+        self._arith(lanes, words, Intcode.OP_LT)
+
+    def _eq(self, lanes, words):
+        self._arith(lanes, words, Intcode.OP_EQ)
+
+    def _input(self, lanes, words):
+        # Lanes with no input left block, without advancing the pc,
+        # exactly as Intcode does.
+        waiting = self.input_pos[lanes] >= self.input_count[lanes]
+        self.state[lanes[waiting]] = BatchIntcode.BLOCKED
+        lanes = lanes[~waiting]
+        words = words[~waiting]
+        _, (addr,), ok = self._write_params(lanes, words, 1)
+        lanes, words, addr = self._split(lanes, words, ok, addr)
+        self.memory[lanes, addr] = self.inputs[lanes, self.input_pos[lanes]]
+        self.input_pos[lanes] += 1
+        self.pc[lanes] += 2
+        self.instruction_count[lanes] += 1
+
+    def _output(self, lanes, words):
+        (x,), _, ok = self._params(lanes, words, 1)
+        lanes, words, x = self._split(lanes, words, ok, x)
+        outputs = self.outputs
+        for lane, value in zip(lanes.tolist(), x.tolist()):
+            outputs[lane].append(value)
+        self.pc[lanes] += 2
+        self.instruction_count[lanes] += 1
+
+    def _jump(self, lanes, words, if_true):
+        (x, target), _, ok = self._params(lanes, words, 2)
+        lanes, words, x, target = self._split(lanes, words, ok, x, target)
+        taken = (x != 0) if if_true else (x == 0)
+        self.pc[lanes] = np.where(taken, target, self.pc[lanes] + 3)
+        self.instruction_count[lanes] += 1
+
+    def _jmpif(self, lanes, words):
+        self._jump(lanes, words, True)
+
+    def _jmpifnot(self, lanes, words):
+        self._jump(lanes, words, False)
+
+    def _rel(self, lanes, words):
+        (x,), _, ok = self._params(lanes, words, 1)
+        lanes, words, x = self._split(lanes, words, ok, x)
+        self.relative_base[lanes] += x
+        self.pc[lanes] += 2
+        self.instruction_count[lanes] += 1
+
+    def _halt(self, lanes, words):
+        self.state[lanes] = BatchIntcode.HALTED
+        self.pc[lanes] += 2
+        self.instruction_count[lanes] += 1
+
+    HANDLERS = {
+        Intcode.OP_ADD:      _add,
+        Intcode.OP_MUL:      _mul,
+        Intcode.OP_INPUT:    _input,
+        Intcode.OP_OUTPUT:   _output,
+        Intcode.OP_JMPIF:    _jmpif,
+        Intcode.OP_JMPIFNOT: _jmpifnot,
+        Intcode.OP_LT:       _lt,
+        Intcode.OP_EQ:       _eq,
+        Intcode.OP_REL:      _rel,
+        Intcode.OP_HALT:     _halt,
+    }
+
+    def machine(self, lane):
+        # Return an Intcode in the same state as lane.
+        if lane in self.machines:
+            return self.machines[lane]
+        row = self.memory[lane]
+        machine = Intcode(row.tolist(), memory=ListMemory)
+        machine.program = self.program
+        machine.dirty = set(np.flatnonzero(row != self.pristine).tolist())
+        machine.pc = int(self.pc[lane])
+        machine.relative_base = int(self.relative_base[lane])
+        machine.instruction_count = int(self.instruction_count[lane])
+        pos, end = self.input_pos[lane], self.input_count[lane]
+        machine.inputs.extend(self.inputs[lane, pos:end].tolist())
+        machine.on_output = self.outputs[lane].append
+        if self.state[lane] == BatchIntcode.HALTED:
+            machine.state = Intcode.HALTED
+        elif self.state[lane] == BatchIntcode.BLOCKED:
+            machine.state = Intcode.BLOCKED
+        return machine
+
+    def _fall_back(self, lanes):
+        # Hand lanes over to the scalar interpreter. They are run to
+        # completion at the end of run().
+        for lane in lanes.tolist():
+            self.machines[lane] = self.machine(lane)
+            self.state[lane] = BatchIntcode.SCALAR
@@ -0,0 +1,94 @@
+#! /usr/bin/env python3
+
+# Regression checks for intcode.py. Run with python3 -m unittest.
+
+import unittest
+
+from intcode import Intcode
+
+
+class TraceTest(unittest.TestCase):
+
+    # Reads two inputs and outputs their sum
+    PROGRAM = [3, 20, 3, 21, 1, 20, 21, 22, 4, 22, 99]
+
+    def traced_run(self, compiled):
+        machine = Intcode(self.PROGRAM, [1, 2], compiled=compiled)
+        machine.enable_tracing(interval=1)
+        machine.run()
+        return machine
+
+    def test_replay_after_reset(self):
+        for compiled in (False, True):
+            machine = self.traced_run(compiled)
+            machine.reset([10, 20])
+            machine.run()
+            self.assertEqual(list(machine.outputs), [30])
+            replayed = machine.replay(3)
+            replayed.run()
+            self.assertEqual(list(replayed.outputs), [30])
+
+    def test_replay_after_load_checkpoint(self):
+        for compiled in (False, True):
+            source = Intcode(self.PROGRAM, [10], compiled=compiled)
+            source.run()
+            machine = self.traced_run(compiled)
+            machine.load_checkpoint(source.checkpoint())
+            machine.add_input(20)
+            machine.run()
+            self.assertEqual(list(machine.outputs), [30])
+            replayed = machine.replay(3)
+            replayed.run()
+            self.assertEqual(list(replayed.outputs), [30])
+
+    def test_replay_from_blocked_checkpoint(self):
+        # In compiled mode the first block runs past the checkpoint
+        # interval and blocks, so the checkpoint is taken while BLOCKED.
+        machine = Intcode(self.PROGRAM, compiled=True)
+        machine.enable_tracing(interval=1)
+        machine.add_input(1)
+        machine.run()
+        machine.add_input(2)
+        machine.run()
+        self.assertEqual(list(machine.outputs), [3])
+        for count in (2, 3):
+            replayed = machine.replay(count)
+            self.assertEqual(replayed.instruction_count, count)
+            replayed.run()
+            self.assertEqual(list(replayed.outputs), [3])
+
+    def test_replay_tracing_enabled_while_blocked(self):
+        for compiled in (False, True):
+            machine = Intcode(self.PROGRAM, compiled=compiled)
+            machine.run()
+            self.assertTrue(machine.is_blocked())
+            machine.enable_tracing(interval=1000)
+            machine.extend_inputs([1, 2])
+            machine.run()
+            replayed = machine.replay(3)
+            self.assertEqual(replayed.instruction_count, 3)
+            replayed.run()
+            self.assertEqual(list(replayed.outputs), [3])
+
+
+class WatchpointTest(unittest.TestCase):
+
+    def test_input_break_stops_once_per_input(self):
+        # Reads an input and echoes it, twice
+        machine = Intcode([3, 9, 4, 9, 3, 9, 4, 9, 99, 0])
+        machine.add_opcode_break(Intcode.OP_INPUT)
+        events = []
+        for value in (5, 6):
+            # Stops at the INPUT, then blocks on it
+            machine.run()
+            events.append(machine.watch_event)
+            machine.run()
+            self.assertTrue(machine.is_blocked())
+            machine.add_input(value)
+        machine.run()
+        self.assertTrue(machine.is_halted())
+        self.assertEqual(events, [("opcode", 0, 3, None), ("opcode", 4, 3, None)])
+        self.assertEqual(list(machine.outputs), [5, 6])
+
+if __name__ == "__main__":
+    unittest.main()